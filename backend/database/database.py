@@ -1,6 +1,7 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from fastapi.concurrency import run_in_threadpool
 import os
 from dotenv import load_dotenv
 
@@ -12,32 +13,253 @@ DATABASE_URL = os.getenv(
     "sqlite:///./ausadi_thaha.db"  # Changed from PostgreSQL to SQLite
 )
 
+# Opt-in async engine (aiosqlite) - keeps the sync SQLite setup as the default
+USE_ASYNC_DB = os.getenv("USE_ASYNC_DB", "0") == "1"
+ASYNC_DATABASE_URL = os.getenv(
+    "ASYNC_DATABASE_URL",
+    "sqlite+aiosqlite:///./ausadi_thaha.db"
+)
+
 # Create SQLAlchemy engine
 engine = create_engine(
     DATABASE_URL,
     pool_pre_ping=True,
     pool_recycle=300,
+    pool_size=20,
+    max_overflow=40,
+    pool_timeout=10,
+    # Default compiled-statement cache is 500 entries; the services emit
+    # enough distinct statement shapes that hot ones were getting evicted
+    query_cache_size=1200,
     echo=False,  # Set to True for SQL query logging
     connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {}
 )
 
-# Create SessionLocal class
+# SQLite tuning - WAL lets readers proceed while a writer holds the lock,
+# which matters for the read-heavy /medicines endpoints
+if "sqlite" in DATABASE_URL:
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        # SQLite leaves FK enforcement off per connection; without this
+        # the ondelete="CASCADE" constraints are inert and user deletes
+        # would orphan their medicines/log rows (the models rely on the
+        # DB cascading via passive_deletes)
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA mmap_size=268435456")
+        cursor.execute("PRAGMA cache_size=-64000")
+        cursor.close()
+
+# Plain per-request sessions. A thread-scoped registry is a trap here:
+# FastAPI runs dependency setup/teardown and the actual service calls
+# (run_db / the bcrypt pool) on different threadpool threads, so a
+# thread-keyed session can be shared by two concurrent requests and
+# removed out from under a third. The connection pool on the engine is
+# what makes session construction cheap; keep sessions request-scoped.
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+if USE_ASYNC_DB:
+    from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+    async_engine = create_async_engine(
+        ASYNC_DATABASE_URL,
+        pool_pre_ping=True,
+        pool_recycle=300,
+        echo=False
+    )
+    AsyncSessionLocal = async_sessionmaker(
+        async_engine, expire_on_commit=False, class_=AsyncSession
+    )
+
 # Create Base class
 Base = declarative_base()
 
-# Dependency to get database session
-def get_db():
+# Dependency to get database session (async or sync depending on USE_ASYNC_DB)
+if USE_ASYNC_DB:
+    async def get_db():
+        async with AsyncSessionLocal() as db:
+            yield db
+else:
+    def get_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+# Dependency for code paths that interleave ORM access with other awaits
+# (cloud sync, CSV import) and therefore need a plain sync session
+def get_sync_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
 
+# Run a synchronous service call without blocking the event loop:
+# bridged onto the async connection when USE_ASYNC_DB is on, otherwise
+# offloaded to the threadpool
+async def run_db(db, fn, *args, **kwargs):
+    if USE_ASYNC_DB:
+        return await db.run_sync(fn, *args, **kwargs)
+    return await run_in_threadpool(fn, db, *args, **kwargs)
+
+# Startup migration for the persisted lowercase shadow columns:
+# create_all only creates missing tables, so databases that predate the
+# columns would fail every Medicine SELECT without this. Idempotent via
+# the inspector (SQLite's ALTER TABLE has no ADD COLUMN IF NOT EXISTS)
+# and runs on both dialects; the backfill's IS NULL guard makes repeat
+# startups a no-op, and the indexes mirror the model declarations, which
+# create_all also skips for existing tables.
+_LC_SHADOW_COLUMNS = (
+    ("brand_name_lc", "brand_name", "ix_med_brand_lc"),
+    ("generic_name_lc", "generic_name", "ix_med_generic_lc"),
+    ("manufacturer_lc", "manufacturer", "ix_med_manu_lc"),
+)
+
+def _add_medicine_lc_columns(bind):
+    from sqlalchemy import inspect
+    existing = {col["name"] for col in inspect(bind).get_columns("medicines")}
+    with bind.connect() as conn:
+        for column, source, index in _LC_SHADOW_COLUMNS:
+            if column not in existing:
+                conn.exec_driver_sql(
+                    f"ALTER TABLE medicines ADD COLUMN {column} VARCHAR(200)"
+                )
+            conn.exec_driver_sql(
+                f"UPDATE medicines SET {column} = lower({source}) "
+                f"WHERE {column} IS NULL"
+            )
+            conn.exec_driver_sql(
+                f"CREATE INDEX IF NOT EXISTS {index} ON medicines ({column})"
+            )
+        conn.commit()
+
+# Trigram GIN indexes so the ILIKE '%q%' search filters become index
+# probes instead of sequential scans. Postgres-only: SQLite has no
+# trigram opclass, and its LIKE paths are covered by the btree indexes
+# on the model.
+_TRGM_INDEX_COLUMNS = ("brand_name", "generic_name", "manufacturer", "strength", "uses")
+
+def _create_trgm_indexes(bind):
+    if bind.dialect.name != "postgresql":
+        return
+    with bind.connect() as conn:
+        conn.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        for column in _TRGM_INDEX_COLUMNS:
+            conn.exec_driver_sql(
+                f"CREATE INDEX IF NOT EXISTS medicines_{column}_trgm "
+                f"ON medicines USING gin ({column} gin_trgm_ops)"
+            )
+        conn.commit()
+
+# Materialized full-text vector over the searchable medicine columns.
+# A generated column keeps it in sync without trigger plumbing, and the
+# GIN index moves text matching into index space with stemming for free.
+# Postgres-only, like the trigram indexes above.
+def _create_fts_index(bind):
+    if bind.dialect.name != "postgresql":
+        return
+    with bind.connect() as conn:
+        conn.exec_driver_sql(
+            "ALTER TABLE medicines ADD COLUMN IF NOT EXISTS search_vector tsvector "
+            "GENERATED ALWAYS AS (to_tsvector('english', "
+            "coalesce(brand_name, '') || ' ' || coalesce(generic_name, '') || ' ' || "
+            "coalesce(manufacturer, '') || ' ' || coalesce(uses, ''))) STORED"
+        )
+        conn.exec_driver_sql(
+            "CREATE INDEX IF NOT EXISTS medicines_fts "
+            "ON medicines USING gin (search_vector)"
+        )
+        conn.commit()
+
+# BRIN indexes on the append-only log tables' timestamps: block-range
+# metadata stays a few kilobytes however large the table grows, and the
+# 30-day window aggregates become cheap range scans. Postgres-only;
+# SQLite relies on the composite btrees declared on the models. Chosen
+# over a rolling partial index, which would need a nightly rebuild job
+# this deployment does not run.
+def _create_log_brin_indexes(bind):
+    if bind.dialect.name != "postgresql":
+        return
+    with bind.connect() as conn:
+        for table in ("search_logs", "ocr_logs"):
+            conn.exec_driver_sql(
+                f"CREATE INDEX IF NOT EXISTS {table}_created_brin "
+                f"ON {table} USING brin (created_at)"
+            )
+        conn.commit()
+
+# Server-side stats aggregation: one function call returns every count
+# the user dashboard needs, so the round-trips collapse to a single
+# SELECT and the subqueries all run inside one planner invocation.
+# STABLE lets Postgres cache the plan across calls. Postgres-only;
+# SQLite callers keep the fused FILTER-clause queries in UserService.
+def _create_user_stats_function(bind):
+    if bind.dialect.name != "postgresql":
+        return
+    with bind.connect() as conn:
+        conn.exec_driver_sql(
+            "CREATE OR REPLACE FUNCTION user_stats(uid integer) "
+            "RETURNS TABLE (medicines_created bigint, total_searches bigint, "
+            "recent_searches bigint, total_ocr_scans bigint, recent_ocr_scans bigint) "
+            "AS $$ SELECT "
+            "(SELECT count(*) FROM medicines WHERE created_by = uid), "
+            "(SELECT count(*) FROM search_logs WHERE user_id = uid), "
+            "(SELECT count(*) FROM search_logs WHERE user_id = uid "
+            " AND created_at >= now() - interval '30 days'), "
+            "(SELECT count(*) FROM ocr_logs WHERE user_id = uid), "
+            "(SELECT count(*) FROM ocr_logs WHERE user_id = uid "
+            " AND created_at >= now() - interval '30 days') "
+            "$$ LANGUAGE sql STABLE"
+        )
+        conn.commit()
+
+# Per-user top search terms, precomputed. The GROUP BY over search_logs
+# is the one query in user stats whose cost scales with total history
+# rather than the 30-day window; the materialized view turns the read
+# into an indexed five-row fetch. rank <= 10 keeps the view a handful of
+# rows per user, and the unique index permits REFRESH ... CONCURRENTLY.
+# Postgres-only, like the other helpers here.
+def _create_user_top_queries_mv(bind):
+    if bind.dialect.name != "postgresql":
+        return
+    with bind.connect() as conn:
+        conn.exec_driver_sql(
+            "CREATE MATERIALIZED VIEW IF NOT EXISTS user_top_queries AS "
+            "SELECT user_id, query, count(*) AS uses, "
+            "row_number() OVER (PARTITION BY user_id ORDER BY count(*) DESC) AS rank "
+            "FROM search_logs GROUP BY user_id, query"
+        )
+        conn.exec_driver_sql(
+            "CREATE UNIQUE INDEX IF NOT EXISTS user_top_queries_pk "
+            "ON user_top_queries (user_id, rank)"
+        )
+        conn.commit()
+
+# Refresh hook for the view above - non-blocking thanks to the unique
+# index. There is no scheduler in this codebase, so wire this to cron or
+# the deployment's task runner at whatever cadence the dashboard needs.
+def refresh_user_top_queries(bind=None):
+    bind = bind or engine
+    if bind.dialect.name != "postgresql":
+        return
+    with bind.connect() as conn:
+        conn.exec_driver_sql("REFRESH MATERIALIZED VIEW CONCURRENTLY user_top_queries")
+        conn.commit()
+
 # Database initialization
 def init_db():
     Base.metadata.create_all(bind=engine)
+    _add_medicine_lc_columns(engine)
+    _create_trgm_indexes(engine)
+    _create_fts_index(engine)
+    _create_log_brin_indexes(engine)
+    _create_user_stats_function(engine)
+    _create_user_top_queries_mv(engine)
 
 # Database cleanup
 def close_db():
@@ -1,10 +1,16 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey, Float
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey, Float, Index, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from datetime import datetime
+from functools import cached_property
 
-Base = declarative_base()
+from database.database import Base
+
+# Normalized reference tables (Manufacturer, GenericName) live on their own
+# registry: no service code reads them yet, so they are only created when
+# FEATURE_NORMALIZED_MEDICINES=1, keeping create_all and the SQLite file small
+NormalizedBase = declarative_base()
 
 class User(Base):
     __tablename__ = "users"
@@ -18,30 +24,87 @@ class User(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
-    # Relationships
-    medicines = relationship("Medicine", back_populates="created_by_user")
+    # Relationships - passive_deletes leaves row removal to the FK
+    # cascade instead of the ORM loading the collection to delete it
+    medicines = relationship("Medicine", back_populates="created_by_user", passive_deletes=True)
 
 class Medicine(Base):
     __tablename__ = "medicines"
 
+    # Composite indexes cover the search hot path (brand/generic and
+    # manufacturer/brand lookups); the leading columns make the old
+    # single-column indexes on brand_name and manufacturer redundant
+    __table_args__ = (
+        Index("ix_med_brand_generic", "brand_name", "generic_name"),
+        Index("ix_med_manu_brand", "manufacturer", "brand_name"),
+        Index("ix_med_brand_lc", "brand_name_lc"),
+        Index("ix_med_generic_lc", "generic_name_lc"),
+        Index("ix_med_manu_lc", "manufacturer_lc"),
+        Index("ix_med_created_at", "created_at"),
+        # Per-user listings and activity windows filter on created_by and
+        # order/range on created_at; the composite serves them in index
+        # order without a sort
+        Index("ix_med_createdby_created", "created_by", "created_at"),
+        # Aligned with the duplicate check's four equality predicates, so
+        # check_duplicate_medicine and the CSV import's batched dupe probe
+        # resolve via one index lookup instead of a table scan
+        Index("ix_med_dupe_key", "brand_name", "generic_name", "strength", "manufacturer"),
+    )
+
     id = Column(Integer, primary_key=True, index=True)
-    brand_name = Column(String(200), nullable=False, index=True)
+    brand_name = Column(String(200), nullable=False)
     generic_name = Column(String(200), nullable=False, index=True)
     strength = Column(String(100), nullable=False)
-    manufacturer = Column(String(200), nullable=False, index=True)
+    manufacturer = Column(String(200), nullable=False)
     uses = Column(Text, nullable=False)
     side_effects = Column(Text, nullable=False)
     warnings = Column(Text, nullable=False)
     image_url = Column(String(500))
     barcode = Column(String(50), unique=True, index=True)
-    created_by = Column(Integer, ForeignKey("users.id"))
+    # Persisted lowercase shadows, kept in sync by the before_insert/
+    # before_update listeners below. Scoring code reads them instead of
+    # re-lowering the source strings per query, and the btree indexes let
+    # the DB match case-insensitively with plain = / LIKE 'prefix%'
+    brand_name_lc = Column(String(200))
+    generic_name_lc = Column(String(200))
+    manufacturer_lc = Column(String(200))
+    # ON DELETE CASCADE lets "delete this user and everything they own"
+    # run as one statement on schemas created from these models; see
+    # delete_user_data for the fallback on older databases
+    created_by = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
-    # Relationships
-    created_by_user = relationship("User", back_populates="medicines")
-
-class Manufacturer(Base):
+    # Relationships - lazy="raise" makes accidental per-row lazy loads
+    # (the classic N+1) fail loudly instead of silently issuing queries
+    created_by_user = relationship("User", back_populates="medicines", lazy="raise")
+
+    # Structured side effect / warning rows (the _rel suffix avoids clashing
+    # with the legacy Text columns above). lazy="selectin" batch-fetches the
+    # children with one WHERE medicine_id IN (...) query per collection,
+    # regardless of how many medicines were loaded
+    side_effects_rel = relationship("SideEffect", lazy="selectin")
+    warnings_rel = relationship("Warning", lazy="selectin")
+
+    # Memoized ISO strings for the serializers: list endpoints format the
+    # timestamps once per loaded row instead of once per response walk
+    # (the result caches reuse the same instances across requests)
+    @cached_property
+    def created_at_iso(self):
+        return self.created_at.isoformat() if self.created_at else None
+
+    @cached_property
+    def updated_at_iso(self):
+        return self.updated_at.isoformat() if self.updated_at else None
+
+@event.listens_for(Medicine, "before_insert")
+@event.listens_for(Medicine, "before_update")
+def _set_medicine_lowercase_shadows(mapper, connection, target):
+    target.brand_name_lc = (target.brand_name or "").lower()
+    target.generic_name_lc = (target.generic_name or "").lower()
+    target.manufacturer_lc = (target.manufacturer or "").lower()
+
+class Manufacturer(NormalizedBase):
     __tablename__ = "manufacturers"
 
     id = Column(Integer, primary_key=True, index=True)
@@ -53,7 +116,7 @@ class Manufacturer(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
-class GenericName(Base):
+class GenericName(NormalizedBase):
     __tablename__ = "generic_names"
 
     id = Column(Integer, primary_key=True, index=True)
@@ -83,8 +146,15 @@ class Warning(Base):
 class SearchLog(Base):
     __tablename__ = "search_logs"
 
+    # User history and stats queries filter on user_id and order or
+    # range-filter on created_at; the composite index serves them as a
+    # tight range scan in index order instead of a bitmap scan plus sort
+    __table_args__ = (
+        Index("ix_searchlog_user_created", "user_id", "created_at"),
+    )
+
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
     query = Column(String(500), nullable=False)
     search_type = Column(String(50))  # text, ocr, barcode
     results_count = Column(Integer, default=0)
@@ -94,14 +164,29 @@ class SearchLog(Base):
 class OCRLog(Base):
     __tablename__ = "ocr_logs"
 
+    # Same access pattern as SearchLog above
+    __table_args__ = (
+        Index("ix_ocrlog_user_created", "user_id", "created_at"),
+    )
+
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
     image_url = Column(String(500))
     extracted_text = Column(Text)
     confidence_score = Column(Float)
     processing_time = Column(Float)  # in seconds
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+class ApiKey(Base):
+    __tablename__ = "api_keys"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    # Keyed BLAKE2 digest of the issued key - the raw secret is never
+    # stored, and the unique index makes validation one probe
+    key_digest = Column(String(64), unique=True, index=True, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
 class SyncLog(Base):
     __tablename__ = "sync_logs"
 
@@ -1,32 +1,64 @@
-from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Form, Request, Response, BackgroundTasks
+from pydantic import ValidationError
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 from sqlalchemy.orm import Session
 from typing import List, Optional
+import asyncio
 import uvicorn
 import os
 from dotenv import load_dotenv
 
-from database.database import get_db, engine
-from database.models import Base
-from schemas.medicine import MedicineCreate, MedicineUpdate, MedicineResponse, MedicineSearch
+from database.database import (
+    get_db, get_sync_db, run_db, engine, SessionLocal,
+    _add_medicine_lc_columns,
+    _create_trgm_indexes, _create_fts_index, _create_log_brin_indexes,
+    _create_user_stats_function, _create_user_top_queries_mv,
+)
+from database.models import Base, NormalizedBase, SearchLog, OCRLog
+from schemas.medicine import MedicineCreate, MedicineUpdate, MedicineResponse, MedicineSearch, BULK_MEDICINE_ADAPTER
 from schemas.user import UserCreate, UserLogin, UserResponse
 from services.medicine_service import MedicineService
 from services.user_service import UserService
-from services.auth_service import AuthService, get_current_user, get_current_active_user, get_current_admin_user
+from services.auth_service import AuthService, BCRYPT_POOL, get_current_user, get_current_active_user, get_current_admin_user
 from services.ocr_service import OCRService
 from services.search_service import SearchService
 
 # Load environment variables
 load_dotenv()
 
-# Create database tables
-Base.metadata.create_all(bind=engine)
+_HEALTH_BODY = b'{"status":"healthy"}'
+
+class HealthCheckMiddleware:
+    """Answer /health straight from the ASGI layer.
+
+    Load balancers poll /health every few seconds per instance; serving it
+    with a pre-serialized body before router matching and the middleware
+    stack keeps the cost at a path compare plus a socket write.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] == "/health":
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(_HEALTH_BODY)).encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": _HEALTH_BODY})
+            return
+        await self.app(scope, receive, send)
 
 app = FastAPI(
     title="Ausadi Thaha API",
     description="Medicine identification and management API",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse  # Rust JSON encoder, handles datetime natively
 )
 
 # CORS middleware
@@ -38,9 +70,28 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Added last so it sits outermost, ahead of CORS and the router
+app.add_middleware(HealthCheckMiddleware)
+
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+# Create database tables on startup instead of at import time, so workers
+# don't pay the schema check before the app is even constructed.
+# Set AUTO_MIGRATE=0 when the schema is managed externally (e.g. alembic).
+@app.on_event("startup")
+async def create_tables():
+    if os.getenv("AUTO_MIGRATE", "1") == "1":
+        Base.metadata.create_all(bind=engine)
+        _add_medicine_lc_columns(engine)
+        _create_trgm_indexes(engine)
+        _create_fts_index(engine)
+        _create_log_brin_indexes(engine)
+        _create_user_stats_function(engine)
+        _create_user_top_queries_mv(engine)
+        if os.getenv("FEATURE_NORMALIZED_MEDICINES") == "1":
+            NormalizedBase.metadata.create_all(bind=engine)
+
 # Initialize services
 medicine_service = MedicineService()
 user_service = UserService()
@@ -48,60 +99,180 @@ auth_service = AuthService()
 ocr_service = OCRService()
 search_service = SearchService()
 
+# Cap concurrent OCR jobs at the physical core count - tesseract is
+# CPU-bound and unbounded fan-out just thrashes the machine
+_OCR_SEMAPHORE = asyncio.Semaphore(os.cpu_count() or 1)
+
+# Telemetry writes are queued and flushed in batches - every individual
+# log commit is an fsync, and per-search commits were the main source of
+# tail latency on the search endpoints. Batching amortizes the fsync over
+# up to _LOG_FLUSH_SIZE rows; losing one flush window on a crash is an
+# acceptable telemetry loss.
+_LOG_QUEUE: asyncio.Queue = asyncio.Queue()
+_LOG_FLUSH_SIZE = 500
+_LOG_FLUSH_INTERVAL = 0.2  # seconds
+_log_writer_task: Optional[asyncio.Task] = None
+
+# async so BackgroundTasks runs them on the event loop: asyncio.Queue is
+# not thread-safe, and as plain defs Starlette would call put_nowait from
+# a threadpool thread, racing the drain task's timeout cancellation
+async def _log_search(user_id: Optional[int], query: str, search_type: str, results_count: int):
+    _LOG_QUEUE.put_nowait((SearchLog, {
+        "user_id": user_id,
+        "query": query[:500],
+        "search_type": search_type,
+        "results_count": results_count,
+    }))
+
+async def _log_ocr_scan(user_id: Optional[int], image_url: str, extracted_text: str):
+    _LOG_QUEUE.put_nowait((OCRLog, {
+        "user_id": user_id,
+        "image_url": image_url,
+        "extracted_text": extracted_text,
+    }))
+
+def _flush_log_batch(batch):
+    # Short-lived session per flush so the writer never contends with
+    # request sessions
+    db = SessionLocal()
+    try:
+        for model in (SearchLog, OCRLog):
+            rows = [row for row_model, row in batch if row_model is model]
+            if rows:
+                db.bulk_insert_mappings(model, rows)
+        db.commit()
+    finally:
+        db.close()
+
+async def _drain_log_queue():
+    """Flush queued log rows once _LOG_FLUSH_SIZE entries accumulate or
+    the oldest batched entry turns _LOG_FLUSH_INTERVAL old, whichever
+    comes first. The wait times out against that age deadline rather
+    than per arrival - a steady trickle of rows must not keep deferring
+    the flush until the size threshold fills."""
+    loop = asyncio.get_running_loop()
+    batch = []
+    deadline = None  # loop time the current batch must flush by
+    while True:
+        timeout = _LOG_FLUSH_INTERVAL if deadline is None else max(deadline - loop.time(), 0.0)
+        try:
+            batch.append(await asyncio.wait_for(_LOG_QUEUE.get(), timeout=timeout))
+            if deadline is None:
+                deadline = loop.time() + _LOG_FLUSH_INTERVAL
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            break
+        if batch and (len(batch) >= _LOG_FLUSH_SIZE or loop.time() >= deadline):
+            flush, batch, deadline = batch, [], None
+            # A shutdown cancel landing mid-flush must not skip the
+            # final drain below (the worker thread finishes this flush
+            # either way)
+            try:
+                await asyncio.to_thread(_flush_log_batch, flush)
+            except asyncio.CancelledError:
+                break
+
+    # Cancelled at shutdown: flush whatever is still queued
+    while not _LOG_QUEUE.empty():
+        batch.append(_LOG_QUEUE.get_nowait())
+    if batch:
+        await asyncio.to_thread(_flush_log_batch, batch)
+
+@app.on_event("startup")
+async def start_log_writer():
+    global _log_writer_task
+    _log_writer_task = asyncio.create_task(_drain_log_queue())
+
+@app.on_event("shutdown")
+async def stop_log_writer():
+    if _log_writer_task is not None:
+        _log_writer_task.cancel()
+        await _log_writer_task
+
 @app.get("/")
 async def root():
     return {"message": "Ausadi Thaha API is running"}
 
+# Kept for the OpenAPI docs; requests are actually answered by
+# HealthCheckMiddleware before they reach the router
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
 
-# Authentication endpoints
+# Authentication endpoints - bcrypt is deliberately CPU-expensive, so the
+# whole call (hash/verify + DB work) runs on the dedicated bcrypt pool:
+# off the event loop, and without draining the shared threadpool that every
+# other sync dependency relies on
 @app.post("/auth/register", response_model=UserResponse)
-async def register(user: UserCreate, db: Session = Depends(get_db)):
-    return user_service.create_user(db, user)
+async def register(user: UserCreate, db: Session = Depends(get_sync_db)):
+    return await asyncio.get_running_loop().run_in_executor(
+        BCRYPT_POOL, user_service.create_user, db, user
+    )
 
 @app.post("/auth/login")
-async def login(user: UserLogin, db: Session = Depends(get_db)):
-    return auth_service.login_user(db, user.username, user.password)
+async def login(user: UserLogin, db: Session = Depends(get_sync_db)):
+    return await asyncio.get_running_loop().run_in_executor(
+        BCRYPT_POOL, auth_service.login_user, db, user.username, user.password
+    )
 
 # Medicine endpoints
 @app.get("/medicines", response_model=List[MedicineResponse])
 async def get_medicines(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    after_id: Optional[int] = None,
+    db=Depends(get_db),
     current_user = Depends(get_current_active_user)
 ):
-    return medicine_service.get_medicines(db, skip=skip, limit=limit)
+    # after_id selects keyset pagination (cursor = last id of the previous
+    # page); skip/limit remains for existing clients
+    return await run_db(
+        db, medicine_service.list_medicines,
+        skip=skip, limit=limit, after_id=after_id
+    )
 
 @app.get("/medicines/{medicine_id}", response_model=MedicineResponse)
 async def get_medicine(
     medicine_id: int,
-    db: Session = Depends(get_db),
+    request: Request,
+    response: Response,
+    db=Depends(get_db),
     current_user = Depends(get_current_active_user)
 ):
-    medicine = medicine_service.get_medicine(db, medicine_id)
+    # Revalidate before fetching: a PK-only read of the row timestamps lets
+    # mobile re-fetches skip loading the large Text columns entirely
+    version = await run_db(db, medicine_service.get_medicine_version, medicine_id)
+    if not version:
+        raise HTTPException(status_code=404, detail="Medicine not found")
+
+    stamp = version.updated_at or version.created_at
+    etag = f'W/"{medicine_id}-{stamp.timestamp() if stamp else 0}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304)
+
+    medicine = await run_db(db, medicine_service.get_medicine, medicine_id)
     if not medicine:
         raise HTTPException(status_code=404, detail="Medicine not found")
+    response.headers["ETag"] = etag
     return medicine
 
 @app.post("/medicines", response_model=MedicineResponse)
 async def create_medicine(
     medicine: MedicineCreate,
-    db: Session = Depends(get_db),
+    db=Depends(get_db),
     current_user = Depends(get_current_active_user)
 ):
-    return medicine_service.create_medicine(db, medicine, current_user.id)
+    return await run_db(db, medicine_service.create_medicine, medicine, current_user.id)
 
 @app.put("/medicines/{medicine_id}", response_model=MedicineResponse)
 async def update_medicine(
     medicine_id: int,
     medicine: MedicineUpdate,
-    db: Session = Depends(get_db),
+    db=Depends(get_db),
     current_user = Depends(get_current_active_user)
 ):
-    updated_medicine = medicine_service.update_medicine(db, medicine_id, medicine)
+    updated_medicine = await run_db(db, medicine_service.update_medicine, medicine_id, medicine)
     if not updated_medicine:
         raise HTTPException(status_code=404, detail="Medicine not found")
     return updated_medicine
@@ -109,10 +280,10 @@ async def update_medicine(
 @app.delete("/medicines/{medicine_id}")
 async def delete_medicine(
     medicine_id: int,
-    db: Session = Depends(get_db),
+    db=Depends(get_db),
     current_user = Depends(get_current_active_user)
 ):
-    success = medicine_service.delete_medicine(db, medicine_id)
+    success = await run_db(db, medicine_service.delete_medicine, medicine_id)
     if not success:
         raise HTTPException(status_code=404, detail="Medicine not found")
     return {"message": "Medicine deleted successfully"}
@@ -121,18 +292,24 @@ async def delete_medicine(
 @app.post("/medicines/search")
 async def search_medicines(
     search: MedicineSearch,
-    db: Session = Depends(get_db),
+    background_tasks: BackgroundTasks,
+    db=Depends(get_db),
     current_user = Depends(get_current_active_user)
 ):
-    return search_service.search_medicines(db, search.query, search.limit)
+    results = await run_db(db, search_service.search_medicines, search.query, search.limit)
+    background_tasks.add_task(_log_search, current_user.id, search.query, "text", len(results))
+    return results
 
 @app.post("/medicines/search/fuzzy")
 async def fuzzy_search_medicines(
     search: MedicineSearch,
-    db: Session = Depends(get_db),
+    background_tasks: BackgroundTasks,
+    db=Depends(get_db),
     current_user = Depends(get_current_active_user)
 ):
-    return search_service.fuzzy_search_medicines(db, search.query, search.limit)
+    results = await run_db(db, search_service.fuzzy_search_medicines, search.query, search.limit)
+    background_tasks.add_task(_log_search, current_user.id, search.query, "fuzzy", len(results))
+    return results
 
 # OCR endpoints
 @app.post("/ocr/process")
@@ -142,9 +319,15 @@ async def process_image_ocr(
 ):
     if not file.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="File must be an image")
-    
+
     try:
-        extracted_text, medicine_info = ocr_service.process_image_file(file)
+        payload = await file.read()
+        # OCR is CPU-heavy; run it on a worker thread so the event loop
+        # stays responsive
+        async with _OCR_SEMAPHORE:
+            extracted_text, medicine_info = await asyncio.to_thread(
+                ocr_service.process_image_file, payload
+            )
         return {
             "extracted_text": extracted_text,
             "medicine_info": medicine_info
@@ -152,23 +335,57 @@ async def process_image_ocr(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"OCR processing failed: {str(e)}")
 
+@app.post("/ocr/process-batch")
+async def process_images_ocr_batch(
+    files: List[UploadFile] = File(...),
+    current_user = Depends(get_current_active_user)
+):
+    for file in files:
+        if not file.content_type.startswith("image/"):
+            raise HTTPException(status_code=400, detail="All files must be images")
+
+    try:
+        payloads = [await file.read() for file in files]
+        # The service fans the batch out over a process pool (one
+        # single-threaded tesseract per core); to_thread keeps the
+        # event loop free while the pool works
+        texts = await asyncio.to_thread(ocr_service.process_images_batch, payloads)
+        return {
+            "results": [
+                {"filename": file.filename, "extracted_text": text}
+                for file, text in zip(files, texts)
+            ]
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"OCR processing failed: {str(e)}")
+
 @app.post("/ocr/search")
 async def search_by_ocr(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     limit: int = Form(3),
-    db: Session = Depends(get_db),
+    db=Depends(get_db),
     current_user = Depends(get_current_active_user)
 ):
     if not file.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="File must be an image")
-    
+
     try:
-        # Process OCR
-        extracted_text, medicine_info = ocr_service.process_image_file(file)
-        
+        # Process OCR on a worker thread, bounded by the CPU semaphore
+        payload = await file.read()
+        async with _OCR_SEMAPHORE:
+            extracted_text, medicine_info = await asyncio.to_thread(
+                ocr_service.process_image_file, payload
+            )
+
         # Search medicines using OCR text
-        search_results = search_service.search_by_ocr_text(db, extracted_text, limit)
-        
+        search_results = await run_db(db, search_service.search_by_ocr_text, extracted_text, limit)
+
+        background_tasks.add_task(_log_ocr_scan, current_user.id, file.filename, extracted_text)
+        background_tasks.add_task(
+            _log_search, current_user.id, extracted_text, "ocr", len(search_results)
+        )
+
         return {
             "extracted_text": extracted_text,
             "medicine_info": medicine_info,
@@ -180,38 +397,48 @@ async def search_by_ocr(
 # Admin endpoints
 @app.get("/admin/medicines/stats")
 async def get_medicine_stats(
-    db: Session = Depends(get_db),
+    db=Depends(get_db),
     current_user = Depends(get_current_admin_user)
 ):
-    return medicine_service.get_medicine_stats(db)
+    return await run_db(db, medicine_service.get_medicine_stats)
 
 @app.post("/admin/medicines/bulk")
 async def bulk_create_medicines(
-    medicines: List[MedicineCreate],
-    db: Session = Depends(get_db),
+    request: Request,
+    db=Depends(get_db),
     current_user = Depends(get_current_admin_user)
 ):
-    return medicine_service.bulk_create_medicines(db, medicines, current_user.id)
+    # Validate the raw body in a single pydantic-core call; for payloads of
+    # thousands of medicines this is much cheaper than per-item dispatch
+    try:
+        medicines = BULK_MEDICINE_ADAPTER.validate_json(await request.body())
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors())
+    return await run_db(db, medicine_service.bulk_create_medicines, medicines, current_user.id)
 
 @app.post("/admin/medicines/import")
 async def import_medicines_from_file(
     file: UploadFile = File(...),
-    db: Session = Depends(get_db),
+    db=Depends(get_db),
     current_user = Depends(get_current_admin_user)
 ):
     if not file.filename.endswith('.csv'):
         raise HTTPException(status_code=400, detail="File must be a CSV")
-    
+
     try:
-        result = await medicine_service.import_from_csv(db, file)
+        # Hand the spooled upload straight to the importer: Starlette has
+        # already buffered it (memory or temp file), so reading it as a
+        # text stream avoids a full bytes copy plus a decoded str copy
+        result = await run_db(db, medicine_service.import_from_csv, file.file)
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Import failed: {str(e)}")
 
-# Sync endpoints
+# Sync endpoints (cloud sync interleaves awaits with ORM access, so it
+# stays on the plain sync session)
 @app.post("/sync/upload")
 async def upload_to_cloud(
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_sync_db),
     current_user = Depends(get_current_active_user)
 ):
     try:
@@ -222,7 +449,7 @@ async def upload_to_cloud(
 
 @app.post("/sync/download")
 async def download_from_cloud(
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_sync_db),
     current_user = Depends(get_current_active_user)
 ):
     try:
@@ -239,12 +466,12 @@ async def get_current_user_profile(current_user = Depends(get_current_active_use
 @app.get("/users/{user_id}/stats")
 async def get_user_stats(
     user_id: int,
-    db: Session = Depends(get_db),
+    db=Depends(get_db),
     current_user = Depends(get_current_active_user)
 ):
     if current_user.id != user_id and not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Not authorized")
-    return user_service.get_user_stats(db, user_id)
+    return await run_db(db, user_service.get_user_stats, user_id)
 
 if __name__ == "__main__":
     uvicorn.run(
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, TypeAdapter
 from typing import Optional, List
 from datetime import datetime
 
@@ -60,3 +60,7 @@ class MedicineImportResult(BaseModel):
     successful_imports: int
     failed_imports: int
     errors: List[str]
+
+# Pre-built adapter for the bulk endpoint: validates the whole list in one
+# pydantic-core call instead of FastAPI dispatching per item
+BULK_MEDICINE_ADAPTER = TypeAdapter(List[MedicineCreate])
@@ -1,59 +1,151 @@
 from datetime import datetime, timedelta
 from typing import Optional, Union
-from jose import JWTError, jwt
-from passlib.context import CryptContext
+import jwt
 from fastapi import HTTPException, status, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
+from cachetools import TTLCache
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+import threading
+import time
 
 from database.models import User
-from services.user_service import UserService
-from database.database import get_db
+from services.user_service import UserService, pwd_context
+from database.database import get_db, run_db
 
-# Configuration
-SECRET_KEY = "your-secret-key-here"  # In production, use environment variable
-ALGORITHM = "HS256"
+# Configuration: HS256 with a shared secret by default. Asymmetric
+# signing is opt-in - set JWT_ALGORITHM (e.g. "EdDSA") and point
+# JWT_PRIVATE_KEY_FILE / JWT_PUBLIC_KEY_FILE at PEM files. Keys are
+# loaded and parsed once at import, never per verify, and verifiers
+# only ever need the public half - no shared-secret distribution.
+SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-here")
+ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 REFRESH_TOKEN_EXPIRE_DAYS = 7
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+def _load_key_file(env_var: str) -> Optional[str]:
+    """Read a PEM key named by an env var, if configured"""
+    path = os.getenv(env_var)
+    if path and os.path.exists(path):
+        with open(path) as fh:
+            return fh.read()
+    return None
+
+_SIGNING_KEY = _load_key_file("JWT_PRIVATE_KEY_FILE") or SECRET_KEY
+_VERIFY_KEY = _load_key_file("JWT_PUBLIC_KEY_FILE") or SECRET_KEY
+
+# Verified-token cache: every authenticated request re-runs HMAC + base64 +
+# JSON decode on the same bearer token otherwise. Keys are SHA-256 digests
+# so long tokens don't bloat the cache. The revocation cache mirrors it for
+# logout; its TTL covers the longest-lived (refresh) tokens.
+_token_cache = TTLCache(maxsize=10_000, ttl=60)
+_revoked_tokens = TTLCache(maxsize=10_000, ttl=REFRESH_TOKEN_EXPIRE_DAYS * 86400)
+_token_cache_lock = threading.Lock()
+
+# Reissue cache: clients that retry /auth/refresh in quick succession get
+# the just-minted access token back instead of a second signature + DB hit
+_reissue_cache = TTLCache(maxsize=10_000, ttl=5)
+
+# Cross-process revocation: with multiple workers the in-process revoked
+# set can't see logouts handled by a sibling. Set REDIS_URL to share the
+# blacklist (keys "bl:<sha256>", TTL = remaining token lifetime); left
+# unset, revocation stays local, matching the single-worker default.
+try:
+    import redis as _redis
+except ImportError:  # pragma: no cover - optional dependency
+    _redis = None
+
+REDIS_URL = os.getenv("REDIS_URL")
+_blacklist = (
+    _redis.Redis.from_url(REDIS_URL)
+    if REDIS_URL and _redis is not None
+    else None
+)
 
 # Security scheme
 security = HTTPBearer()
 
+# Dedicated pool for bcrypt hash/verify work, sized to the core count. A
+# burst of logins on the shared threadpool would starve every other sync
+# dependency; confining the ~100ms hashes here caps the damage.
+BCRYPT_POOL = ThreadPoolExecutor(
+    max_workers=os.cpu_count() or 1, thread_name_prefix="bcrypt"
+)
+
+# Permission sets are constants; shared frozensets make permission checks
+# allocation-free O(1) lookups. Callers must treat them as read-only.
+_ADMIN_PERMS = frozenset({"read:all", "write:all", "delete:all", "admin:all"})
+_USER_PERMS = frozenset({"read:own", "write:own"})
+
 class AuthService:
     def __init__(self):
         self.user_service = UserService()
 
     def create_access_token(self, data: dict, expires_delta: Optional[timedelta] = None) -> str:
         """Create a new access token"""
-        to_encode = data.copy()
+        # exp is a plain integer epoch - the JWT spec wants a NumericDate
+        # anyway, and this skips two datetime constructions per mint
         if expires_delta:
-            expire = datetime.utcnow() + expires_delta
+            expire = int(time.time() + expires_delta.total_seconds())
         else:
-            expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-        
-        to_encode.update({"exp": expire, "type": "access"})
-        encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-        return encoded_jwt
+            expire = int(time.time()) + ACCESS_TOKEN_EXPIRE_MINUTES * 60
+
+        return jwt.encode(
+            {**data, "exp": expire, "type": "access"},
+            _SIGNING_KEY, algorithm=ALGORITHM,
+        )
 
     def create_refresh_token(self, data: dict) -> str:
         """Create a new refresh token"""
-        to_encode = data.copy()
-        expire = datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
-        to_encode.update({"exp": expire, "type": "refresh"})
-        encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-        return encoded_jwt
+        expire = int(time.time()) + REFRESH_TOKEN_EXPIRE_DAYS * 86400
+        return jwt.encode(
+            {**data, "exp": expire, "type": "refresh"},
+            _SIGNING_KEY, algorithm=ALGORITHM,
+        )
 
     def verify_token(self, token: str) -> Optional[dict]:
         """Verify and decode a JWT token"""
+        # Fast-reject obviously malformed tokens (wrong segment count or
+        # implausible length) before spending any cycles on hashing/crypto;
+        # the smallest real token this API mints is well over 100 chars
+        if not token or token.count(".") != 2 or not 100 < len(token) < 4096:
+            return None
+
+        key = hashlib.sha256(token.encode()).digest()
+
+        with _token_cache_lock:
+            if key in _revoked_tokens:
+                return None
+            payload = _token_cache.get(key)
+
+        if payload is not None:
+            # Cached entries outlive their own exp claim, so re-check it
+            if payload.get("exp", 0) > time.time():
+                return payload
+            return None
+
+        # Local miss: consult the shared blacklist before the signature
+        # check. Cache hits skip this; the 60s cache TTL bounds how long a
+        # revocation from another worker can lag.
+        if _blacklist is not None:
+            try:
+                if _blacklist.exists(b"bl:" + key):
+                    return None
+            except Exception:
+                # Redis unavailable - degrade to local-only revocation
+                pass
+
         try:
-            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-            return payload
-        except JWTError:
+            payload = jwt.decode(token, _VERIFY_KEY, algorithms=[ALGORITHM])
+        except jwt.PyJWTError:
             return None
 
+        with _token_cache_lock:
+            _token_cache[key] = payload
+        return payload
+
     def authenticate_user(self, db: Session, username: str, password: str) -> Optional[User]:
         """Authenticate user with username/email and password"""
         return self.user_service.authenticate_user(db, username, password)
@@ -67,11 +159,11 @@ class AuthService:
         username: str = payload.get("sub")
         if username is None:
             return None
-        
-        user = self.user_service.get_user_by_username(db, username)
+
+        user = self.user_service.get_user_by_username_cached(db, username)
         if user is None:
             return None
-        
+
         return user
 
     def get_current_active_user(self, db: Session, token: str) -> Optional[User]:
@@ -87,28 +179,37 @@ class AuthService:
 
     def refresh_access_token(self, db: Session, refresh_token: str) -> Optional[str]:
         """Refresh access token using refresh token"""
+        # verify_token serves repeat refresh tokens from its cache, so the
+        # common path here is dict lookups, not signature checks
         payload = self.verify_token(refresh_token)
         if payload is None:
             return None
-        
+
         token_type = payload.get("type")
         if token_type != "refresh":
             return None
-        
+
         username: str = payload.get("sub")
         if username is None:
             return None
-        
-        user = self.user_service.get_user_by_username(db, username)
+
+        with _token_cache_lock:
+            access_token = _reissue_cache.get(username)
+        if access_token is not None:
+            return access_token
+
+        user = self.user_service.get_user_by_username_cached(db, username)
         if user is None or not user.is_active:
             return None
-        
+
         # Create new access token
         access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
         access_token = self.create_access_token(
             data={"sub": user.username}, expires_delta=access_token_expires
         )
-        
+
+        with _token_cache_lock:
+            _reissue_cache[username] = access_token
         return access_token
 
     def login_user(self, db: Session, username: str, password: str) -> Optional[dict]:
@@ -144,9 +245,19 @@ class AuthService:
         }
 
     def logout_user(self, token: str) -> bool:
-        """Logout user (in a real implementation, you might want to blacklist the token)"""
-        # For now, we just return True
-        # In production, you might want to add the token to a blacklist
+        """Logout user by revoking the token"""
+        payload = self.verify_token(token)
+        key = hashlib.sha256(token.encode()).digest()
+        with _token_cache_lock:
+            _token_cache.pop(key, None)
+            _revoked_tokens[key] = True
+        if _blacklist is not None and payload is not None:
+            ttl = int(payload.get("exp", 0) - time.time())
+            if ttl > 0:
+                try:
+                    _blacklist.setex(b"bl:" + key, ttl, b"1")
+                except Exception:
+                    pass
         return True
 
     def change_password(self, db: Session, user_id: int, old_password: str, new_password: str) -> bool:
@@ -224,29 +335,13 @@ class AuthService:
         # For now, we just return True
         return True
 
-    def get_user_permissions(self, user: User) -> list:
+    def get_user_permissions(self, user: User) -> frozenset:
         """Get user permissions"""
-        permissions = []
-        
-        if user.is_admin:
-            permissions.extend([
-                "read:all",
-                "write:all",
-                "delete:all",
-                "admin:all"
-            ])
-        else:
-            permissions.extend([
-                "read:own",
-                "write:own"
-            ])
-        
-        return permissions
+        return _ADMIN_PERMS if user.is_admin else _USER_PERMS
 
     def check_permission(self, user: User, permission: str) -> bool:
         """Check if user has a specific permission"""
-        permissions = self.get_user_permissions(user)
-        return permission in permissions
+        return permission in self.get_user_permissions(user)
 
     def require_permission(self, permission: str):
         """Decorator to require a specific permission"""
@@ -258,49 +353,48 @@ class AuthService:
             return wrapper
         return decorator
 
-# Dependency functions for FastAPI
-def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
-) -> User:
-    """Dependency to get current user from token"""
-    auth_service = AuthService()
-    user = auth_service.get_current_user(db, credentials.credentials)
-    if user is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Could not validate credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    return user
-
-def get_current_active_user(
-    current_user: User = Depends(get_current_user)
-) -> User:
-    """Dependency to get current active user"""
-    if not current_user.is_active:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Inactive user"
-        )
-    return current_user
-
-def get_current_admin_user(
-    current_user: User = Depends(get_current_active_user)
-) -> User:
-    """Dependency to get current admin user"""
-    if not current_user.is_admin:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not enough permissions"
-        )
-    return current_user
+# Shared instance for the FastAPI dependencies below - AuthService (and the
+# UserService it constructs) is stateless, so building one per request was
+# just allocation churn on the auth hot path
+_auth_service = AuthService()
+
+# Dependency functions for FastAPI. All three are thin variants of one
+# resolver: decode + fetch + role checks happen in a single pass rather
+# than FastAPI resolving a chain of nested Depends per request.
+def _user_dependency(require_active: bool = False, require_admin: bool = False):
+    """Build a dependency that resolves and checks the user in one pass"""
+    async def dependency(
+        credentials: HTTPAuthorizationCredentials = Depends(security),
+        db=Depends(get_db)
+    ) -> User:
+        user = await run_db(db, _auth_service.get_current_user, credentials.credentials)
+        if user is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Could not validate credentials",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        if (require_active or require_admin) and not user.is_active:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Inactive user"
+            )
+        if require_admin and not user.is_admin:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Not enough permissions"
+            )
+        return user
+    return dependency
+
+get_current_user = _user_dependency()
+get_current_active_user = _user_dependency(require_active=True)
+get_current_admin_user = _user_dependency(require_active=True, require_admin=True)
 
 def require_permission(permission: str):
     """Dependency to require a specific permission"""
     def dependency(current_user: User = Depends(get_current_active_user)) -> User:
-        auth_service = AuthService()
-        if not auth_service.check_permission(current_user, permission):
+        if not _auth_service.check_permission(current_user, permission):
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail=f"Permission '{permission}' required"
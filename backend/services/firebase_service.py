@@ -1,9 +1,25 @@
 import firebase_admin
-from firebase_admin import credentials, firestore
+from firebase_admin import credentials, firestore, firestore_async
 from typing import List, Dict, Any, Optional
+from cachetools import TTLCache
+import asyncio
 import json
 import os
 
+# Firestore rejects write batches with more than 500 operations
+FIRESTORE_BATCH_LIMIT = 500
+
+# Fields mirrored in lowercase on upload so Firestore can serve indexed
+# prefix queries instead of the API scanning documents client-side
+SEARCH_SHADOW_FIELDS = ("brand_name", "generic_name", "manufacturer")
+
+def _with_shadow_fields(medicine: Dict[str, Any]) -> Dict[str, Any]:
+    """Return a copy of the medicine dict with lowercase shadow fields"""
+    doc = dict(medicine)
+    for field in SEARCH_SHADOW_FIELDS:
+        doc[f"{field}_lc"] = (medicine.get(field) or "").lower()
+    return doc
+
 class FirebaseService:
     def __init__(self):
         """Initialize Firebase service with credentials"""
@@ -22,27 +38,53 @@ class FirebaseService:
                 
                 firebase_admin.initialize_app(cred)
             
-            self.db = firestore.client()
+            # Async client: Firestore RPCs await on the event loop instead
+            # of blocking it (or hopping through a thread) for their full
+            # duration, so one worker can overlap many in-flight calls
+            self.db = firestore_async.client()
             self.medicines_collection = self.db.collection('medicines')
-            
+
         except Exception as e:
             print(f"Firebase initialization error: {e}")
             self.db = None
             self.medicines_collection = None
 
+        # Barcode scans repeat in bursts (rescans, retries), so keep the
+        # last results local instead of paying a Firestore round-trip each
+        # time. Values are plain dicts, never snapshots.
+        self._barcode_cache = TTLCache(maxsize=4096, ttl=60)
+
+        # DocumentReferences are immutable, so reuse them across calls
+        # instead of allocating one per doc per batch run
+        self._doc_ref_cache: Dict[str, Any] = {}
+
+    def _ref(self, doc_id: str):
+        """Get (or build and pool) the DocumentReference for a medicine id"""
+        ref = self._doc_ref_cache.get(doc_id)
+        if ref is None:
+            ref = self._doc_ref_cache.setdefault(
+                doc_id, self.medicines_collection.document(doc_id)
+            )
+        return ref
+
     async def upload_medicines(self, medicines: List[Dict[str, Any]]) -> bool:
         """Upload medicines to Firebase Firestore"""
         try:
             if not self.medicines_collection:
                 raise Exception("Firebase not initialized")
 
-            batch = self.db.batch()
-            
+            # Chunk to stay under the 500-op batch limit, then commit the
+            # chunks concurrently so the round-trips overlap
+            commits = []
+            for start in range(0, len(medicines), FIRESTORE_BATCH_LIMIT):
+                batch = self.db.batch()
+                for medicine in medicines[start:start + FIRESTORE_BATCH_LIMIT]:
+                    batch.set(self._ref(str(medicine['id'])), _with_shadow_fields(medicine))
+                commits.append(batch.commit())
+
+            await asyncio.gather(*commits)
             for medicine in medicines:
-                doc_ref = self.medicines_collection.document(str(medicine['id']))
-                batch.set(doc_ref, medicine)
-            
-            batch.commit()
+                self._barcode_cache.pop(medicine.get('barcode'), None)
             return True
             
         except Exception as e:
@@ -55,14 +97,9 @@ class FirebaseService:
             if not self.medicines_collection:
                 raise Exception("Firebase not initialized")
 
-            medicines = []
-            docs = self.medicines_collection.stream()
-            
-            for doc in docs:
-                medicine_data = doc.to_dict()
-                medicines.append(medicine_data)
-            
-            return medicines
+            # Comprehension keeps the drain loop in C instead of paying
+            # per-doc bytecode and list-resize overhead on large catalogs
+            return [doc.to_dict() async for doc in self.medicines_collection.stream()]
             
         except Exception as e:
             print(f"Error downloading medicines from Firebase: {e}")
@@ -74,8 +111,8 @@ class FirebaseService:
             if not self.medicines_collection:
                 raise Exception("Firebase not initialized")
 
-            doc_ref = self.medicines_collection.document(str(medicine['id']))
-            doc_ref.set(medicine)
+            await self._ref(str(medicine['id'])).set(_with_shadow_fields(medicine))
+            self._barcode_cache.pop(medicine.get('barcode'), None)
             return True
             
         except Exception as e:
@@ -88,8 +125,10 @@ class FirebaseService:
             if not self.medicines_collection:
                 raise Exception("Firebase not initialized")
 
-            doc_ref = self.medicines_collection.document(str(medicine_id))
-            doc_ref.delete()
+            await self._ref(str(medicine_id)).delete()
+            # Only the id is known here, so drop every cached barcode; the
+            # cache refills on the next scan
+            self._barcode_cache.clear()
             return True
             
         except Exception as e:
@@ -102,34 +141,78 @@ class FirebaseService:
             if not self.medicines_collection:
                 raise Exception("Firebase not initialized")
 
-            # Simple text search - in production, you might want to use Algolia or similar
+            # Indexed prefix queries on the lowercase shadow fields - the
+            # server does the filtering, so we read O(limit) docs instead
+            # of scanning the collection client-side
+            query_lc = query.lower()
+
+            async def _prefix_query(field):
+                stream = (
+                    self.medicines_collection
+                    .where(f"{field}_lc", ">=", query_lc)
+                    .where(f"{field}_lc", "<=", query_lc + "\uf8ff")
+                    .limit(limit)
+                    .stream()
+                )
+                return [doc async for doc in stream]
+
+            doc_lists = await asyncio.gather(
+                *[_prefix_query(field) for field in SEARCH_SHADOW_FIELDS]
+            )
+
             medicines = []
-            docs = self.medicines_collection.limit(limit).stream()
-            
-            for doc in docs:
-                medicine_data = doc.to_dict()
-                if (query.lower() in medicine_data.get('brand_name', '').lower() or
-                    query.lower() in medicine_data.get('generic_name', '').lower() or
-                    query.lower() in medicine_data.get('manufacturer', '').lower()):
-                    medicines.append(medicine_data)
-            
-            return medicines[:limit]
-            
+            seen_ids = set()
+            for docs in doc_lists:
+                for doc in docs:
+                    if doc.id not in seen_ids:
+                        seen_ids.add(doc.id)
+                        medicines.append(doc.to_dict())
+
+            if medicines:
+                return medicines[:limit]
+
+            # Fallback scan for documents uploaded before the shadow
+            # fields existed
+            return await self._scan_medicines(query_lc, limit)
+
         except Exception as e:
             print(f"Error searching medicines in Firebase: {e}")
             return []
 
+    async def _scan_medicines(self, query: str, limit: int) -> List[Dict[str, Any]]:
+        """Legacy client-side substring scan (degraded path)"""
+        # One joined, casefolded haystack per doc: a single substring scan
+        # and lowercase allocation instead of three of each
+        needle = query.casefold()
+        medicines = []
+        async for doc in self.medicines_collection.limit(limit).stream():
+            medicine_data = doc.to_dict()
+            haystack = " ".join((
+                medicine_data.get('brand_name') or '',
+                medicine_data.get('generic_name') or '',
+                medicine_data.get('manufacturer') or '',
+            )).casefold()
+            if needle in haystack:
+                medicines.append(medicine_data)
+        return medicines[:limit]
+
     async def get_medicine_by_barcode(self, barcode: str) -> Optional[Dict[str, Any]]:
         """Get medicine by barcode from Firebase"""
         try:
             if not self.medicines_collection:
                 raise Exception("Firebase not initialized")
 
+            cached = self._barcode_cache.get(barcode)
+            if cached is not None:
+                return cached
+
             docs = self.medicines_collection.where('barcode', '==', barcode).limit(1).stream()
-            
-            for doc in docs:
-                return doc.to_dict()
-            
+
+            async for doc in docs:
+                medicine_data = doc.to_dict()
+                self._barcode_cache[barcode] = medicine_data
+                return medicine_data
+
             return None
             
         except Exception as e:
@@ -151,7 +234,7 @@ class FirebaseService:
                 'medicines': medicines
             }
             
-            backup_doc.set(backup_data)
+            await backup_doc.set(backup_data)
             return True
             
         except Exception as e:
@@ -167,7 +250,7 @@ class FirebaseService:
             backup_collection = self.db.collection('backups')
             backup_doc = backup_collection.document('latest')
             
-            backup_data = backup_doc.get()
+            backup_data = await backup_doc.get()
             if backup_data.exists:
                 return backup_data.to_dict().get('medicines', [])
             
@@ -1,24 +1,206 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import func, desc, and_, or_
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy import func, desc, and_, or_, insert, select, text, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
 from typing import List, Optional, Dict, Any
+from operator import itemgetter
 import csv
+import heapq
 import io
+import os
 from datetime import datetime, timedelta
 import re
 
-from database.models import Medicine, User, SearchLog, Manufacturer, GenericName, SideEffect, Warning, OCRLog
+from cachetools import TTLCache
+from rapidfuzz import fuzz
+import orjson
+
+from database.models import Medicine, User, SearchLog, SideEffect, Warning, OCRLog
 from schemas.medicine import MedicineCreate, MedicineUpdate, MedicineResponse, MedicineStats
 from services.firebase_service import FirebaseService
 
+# Short-TTL in-process caches for the hot read endpoints. Entries are
+# invalidated on every write path, the TTL just bounds staleness across
+# workers in a multi-process deployment.
+_list_cache = TTLCache(maxsize=1024, ttl=60)
+_detail_cache = TTLCache(maxsize=1024, ttl=60)
+_stats_cache = TTLCache(maxsize=1, ttl=300)
+_analytics_cache = TTLCache(maxsize=1, ttl=60)
+
+# Optional shared tier for the analytics aggregates: dashboards poll these
+# endpoints, and with several workers each process otherwise recomputes the
+# same GROUP BY scans. Same opt-in pattern as the auth token blacklist.
+try:
+    import redis as _redis
+except ImportError:  # pragma: no cover - optional dependency
+    _redis = None
+
+REDIS_URL = os.getenv("REDIS_URL")
+_shared_cache = (
+    _redis.Redis.from_url(REDIS_URL)
+    if REDIS_URL and _redis is not None
+    else None
+)
+_STATS_KEY = "med:stats"
+_ANALYTICS_KEY = "med:analytics"
+
+def _shared_cache_get(key):
+    if _shared_cache is None:
+        return None
+    try:
+        payload = _shared_cache.get(key)
+    except Exception:
+        return None
+    return orjson.loads(payload) if payload else None
+
+def _shared_cache_set(key, value, ttl):
+    if _shared_cache is None:
+        return
+    try:
+        _shared_cache.setex(key, ttl, orjson.dumps(value))
+    except Exception:
+        pass
+
+def _shared_cache_drop():
+    if _shared_cache is None:
+        return
+    try:
+        _shared_cache.delete(_STATS_KEY, _ANALYTICS_KEY)
+    except Exception:
+        pass
+
+# Optional compiled Aho-Corasick automaton over the brand catalog: one
+# O(len(text)) pass finds every known brand inside free text (OCR output),
+# instead of one ILIKE/fuzzy probe per candidate term. Built lazily from
+# the first session that needs it and dropped on every write.
+try:
+    import ahocorasick as _ahocorasick
+except ImportError:  # pragma: no cover - optional dependency
+    _ahocorasick = None
+
+_brand_automaton = None
+
+def _get_brand_automaton(db):
+    global _brand_automaton
+    if _ahocorasick is None:
+        return None
+    if _brand_automaton is None:
+        automaton = _ahocorasick.Automaton()
+        for medicine_id, brand_lc in db.query(Medicine.id, Medicine.brand_name_lc):
+            # Very short names match everywhere in noisy OCR text
+            if brand_lc and len(brand_lc) >= 4:
+                automaton.add_word(brand_lc, (medicine_id, brand_lc))
+        automaton.make_automaton()
+        _brand_automaton = automaton
+    return _brand_automaton
+
+def _drop_brand_automaton():
+    global _brand_automaton
+    _brand_automaton = None
+
+# Barcode validation runs per CSV row on imports: translate() strips the
+# separators in one C call (no regex engine), and the compiled pattern
+# folds the digits-only and length checks into a single match
+_BARCODE_STRIP = str.maketrans('', '', ' -\t\n\r')
+_BARCODE_RE = re.compile(r'\d{8,13}')
+
 class MedicineService:
     def __init__(self):
         self.firebase_service = FirebaseService()
 
-    def get_medicines(self, db: Session, skip: int = 0, limit: int = 100) -> List[Medicine]:
-        return db.query(Medicine).offset(skip).limit(limit).all()
+    def _invalidate_caches(self, medicine_id: Optional[int] = None):
+        """Drop cached reads after a write"""
+        _list_cache.clear()
+        _stats_cache.clear()
+        _analytics_cache.clear()
+        _shared_cache_drop()
+        _drop_brand_automaton()
+        if medicine_id is not None:
+            _detail_cache.pop(medicine_id, None)
+        else:
+            _detail_cache.clear()
+
+    def get_medicines(self, db: Session, skip: int = 0, limit: int = 100,
+                      after_id: Optional[int] = None) -> List[Medicine]:
+        # selectinload fetches all creators in one IN-clause query instead
+        # of one lazy SELECT per medicine
+        query = db.query(Medicine).options(selectinload(Medicine.created_by_user))
+        if after_id is not None:
+            return query.filter(Medicine.id > after_id).order_by(Medicine.id).limit(limit).all()
+        return query.offset(skip).limit(limit).all()
+
+    def list_medicines(self, db: Session, skip: int = 0, limit: int = 100,
+                       after_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Read path for GET /medicines: plain Core rows, no ORM hydration.
+
+        The list endpoint only serializes column values, so skipping
+        identity-map and unit-of-work bookkeeping saves per-row overhead;
+        the row mappings feed straight into MedicineResponse validation.
+
+        Pagination is keyset when after_id is given - WHERE id > :after
+        walks the PK index at constant cost per page, where OFFSET has to
+        scan and discard skip rows first. The offset form stays for
+        clients that still send skip.
+        """
+        cached = _list_cache.get((skip, limit, after_id))
+        if cached is not None:
+            return cached
+
+        stmt = select(Medicine.__table__)
+        if after_id is not None:
+            stmt = stmt.where(Medicine.id > after_id).order_by(Medicine.id).limit(limit)
+        else:
+            stmt = stmt.offset(skip).limit(limit)
+
+        rows = db.execute(stmt).mappings().all()
+        _list_cache[(skip, limit, after_id)] = rows
+        return rows
 
     def get_medicine(self, db: Session, medicine_id: int) -> Optional[Medicine]:
-        return db.query(Medicine).filter(Medicine.id == medicine_id).first()
+        cached = _detail_cache.get(medicine_id)
+        if cached is not None:
+            return cached
+
+        medicine = db.query(Medicine).filter(Medicine.id == medicine_id).first()
+        if medicine is not None:
+            _detail_cache[medicine_id] = medicine
+        return medicine
+
+    def get_medicine_version(self, db: Session, medicine_id: int):
+        """Cheap PK-index read of the row timestamps, used to build ETags
+        without touching the large Text columns"""
+        return db.query(Medicine.id, Medicine.updated_at, Medicine.created_at).filter(
+            Medicine.id == medicine_id
+        ).first()
+
+    def warm_detail_cache(self, medicines: List[Medicine]):
+        """Seed the detail cache with rows already in hand.
+
+        Users almost always open /medicines/{id} right after a search, so
+        prefetching the rows a search just returned turns that follow-up
+        request into a cache hit.
+        """
+        for medicine in medicines:
+            _detail_cache[medicine.id] = medicine
+
+    def match_brands_in_text(self, db: Session, text: str, limit: int = 10) -> List[tuple]:
+        """Find known brand names embedded in free text (OCR output).
+
+        One automaton pass over the text replaces a per-term DB search;
+        returns (medicine, matched_brand) pairs, or [] when pyahocorasick
+        is not installed.
+        """
+        automaton = _get_brand_automaton(db)
+        if automaton is None:
+            return []
+        hits = {}
+        for _, (medicine_id, brand_lc) in automaton.iter(text.lower()):
+            hits.setdefault(medicine_id, brand_lc)
+            if len(hits) >= limit:
+                break
+        if not hits:
+            return []
+        medicines = db.query(Medicine).filter(Medicine.id.in_(hits)).all()
+        return [(medicine, hits[medicine.id]) for medicine in medicines]
 
     def get_medicine_by_barcode(self, db: Session, barcode: str) -> Optional[Medicine]:
         return db.query(Medicine).filter(Medicine.barcode == barcode).first()
@@ -39,6 +221,7 @@ class MedicineService:
         db.add(db_medicine)
         db.commit()
         db.refresh(db_medicine)
+        self._invalidate_caches()
         return db_medicine
 
     def update_medicine(self, db: Session, medicine_id: int, medicine: MedicineUpdate) -> Optional[Medicine]:
@@ -53,6 +236,7 @@ class MedicineService:
         db_medicine.updated_at = datetime.utcnow()
         db.commit()
         db.refresh(db_medicine)
+        self._invalidate_caches(medicine_id)
         return db_medicine
 
     def delete_medicine(self, db: Session, medicine_id: int) -> bool:
@@ -62,9 +246,27 @@ class MedicineService:
 
         db.delete(db_medicine)
         db.commit()
+        self._invalidate_caches(medicine_id)
         return True
 
+    def _fts_filter(self, db: Session, query: str):
+        """Full-text filter on the generated search_vector column.
+
+        Returns None off Postgres or when the query carries LIKE wildcards,
+        in which case callers fall back to the ILIKE chain.
+        """
+        if db.get_bind().dialect.name != "postgresql":
+            return None
+        if "%" in query or "_" in query:
+            return None
+        return text(
+            "search_vector @@ plainto_tsquery('english', :fts_q)"
+        ).bindparams(fts_q=query)
+
     def search_medicines(self, db: Session, query: str, limit: int = 10) -> List[Medicine]:
+        fts = self._fts_filter(db, query)
+        if fts is not None:
+            return db.query(Medicine).filter(fts).limit(limit).all()
         return db.query(Medicine).filter(
             (Medicine.brand_name.ilike(f"%{query}%")) |
             (Medicine.generic_name.ilike(f"%{query}%")) |
@@ -77,14 +279,18 @@ class MedicineService:
         
         # Text search
         if query:
-            base_query = base_query.filter(
-                or_(
-                    Medicine.brand_name.ilike(f"%{query}%"),
-                    Medicine.generic_name.ilike(f"%{query}%"),
-                    Medicine.manufacturer.ilike(f"%{query}%"),
-                    Medicine.uses.ilike(f"%{query}%")
+            fts = self._fts_filter(db, query)
+            if fts is not None:
+                base_query = base_query.filter(fts)
+            else:
+                base_query = base_query.filter(
+                    or_(
+                        Medicine.brand_name.ilike(f"%{query}%"),
+                        Medicine.generic_name.ilike(f"%{query}%"),
+                        Medicine.manufacturer.ilike(f"%{query}%"),
+                        Medicine.uses.ilike(f"%{query}%")
+                    )
                 )
-            )
         
         # Apply filters
         if filters:
@@ -101,76 +307,116 @@ class MedicineService:
 
     def search_medicines_with_confidence(self, db: Session, query: str, limit: int = 10) -> List[Dict[str, Any]]:
         """Search medicines with confidence scores"""
+        if db.get_bind().dialect.name == "postgresql":
+            # Trigram similarity scores inside the GIN index scan and lets
+            # the DB order and cut to top-k, so rejected rows never cross
+            # the wire; weights mirror the Python fallback below
+            score = func.greatest(
+                func.similarity(Medicine.brand_name, query),
+                func.similarity(Medicine.generic_name, query) * 0.9,
+                func.similarity(Medicine.manufacturer, query) * 0.5,
+            ).label('score')
+            rows = db.execute(
+                select(Medicine, score)
+                .where(
+                    Medicine.brand_name.op('%')(query) |
+                    Medicine.generic_name.op('%')(query) |
+                    Medicine.manufacturer.op('%')(query)
+                )
+                .order_by(desc('score'))
+                .limit(limit)
+            ).all()
+            return [
+                {
+                    'medicine': medicine,
+                    'confidence_score': float(confidence),
+                    'matched_text': self._get_matched_text(query, medicine)
+                }
+                for medicine, confidence in rows
+            ]
+
+        # Non-Postgres fallback: fetch candidates, score in Python.
         medicines = self.search_medicines(db, query, limit)
-        results = []
-        
-        for medicine in medicines:
-            confidence = self._calculate_confidence_score(query, medicine)
-            results.append({
+
+        # Top-k via heap (O(n log k)) over plain score tuples; the result
+        # dicts and matched-text lookups are only built for the survivors
+        scored = [
+            (self._calculate_confidence_score(query, medicine), medicine)
+            for medicine in medicines
+        ]
+        return [
+            {
                 'medicine': medicine,
                 'confidence_score': confidence,
                 'matched_text': self._get_matched_text(query, medicine)
-            })
-        
-        # Sort by confidence score
-        results.sort(key=lambda x: x['confidence_score'], reverse=True)
-        return results
+            }
+            for confidence, medicine in heapq.nlargest(limit, scored, key=itemgetter(0))
+        ]
 
     def _calculate_confidence_score(self, query: str, medicine: Medicine) -> float:
-        """Calculate confidence score for search results"""
-        query_lower = query.lower()
-        score = 0.0
-        
-        # Exact matches get highest score
-        if medicine.brand_name.lower() == query_lower:
-            score += 1.0
-        elif medicine.brand_name.lower().startswith(query_lower):
-            score += 0.8
-        elif query_lower in medicine.brand_name.lower():
-            score += 0.6
-        
-        if medicine.generic_name.lower() == query_lower:
-            score += 0.9
-        elif medicine.generic_name.lower().startswith(query_lower):
-            score += 0.7
-        elif query_lower in medicine.generic_name.lower():
-            score += 0.5
-        
-        if medicine.manufacturer.lower() == query_lower:
-            score += 0.5
-        elif query_lower in medicine.manufacturer.lower():
-            score += 0.3
-        
-        return min(score, 1.0)
+        """Calculate confidence score for search results.
+
+        WRatio runs the Levenshtein DP loop in C and tolerates typos,
+        unlike the old hand-rolled exact/prefix/substring branches; the
+        weights keep brand matches ranked ahead of generic/manufacturer.
+        An exact brand hit already caps the score, so the generic and
+        manufacturer comparisons are skipped on the common case where
+        the user typed the brand name verbatim.
+        """
+        brand = fuzz.WRatio(query, medicine.brand_name)
+        if brand >= 100:
+            return 1.0
+        return min(
+            max(
+                brand,
+                0.9 * fuzz.WRatio(query, medicine.generic_name),
+                0.6 * fuzz.WRatio(query, medicine.manufacturer),
+            ) / 100.0,
+            1.0,
+        )
 
     def _get_matched_text(self, query: str, medicine: Medicine) -> str:
         """Get the text that matched the query"""
+        # The persisted _lc shadows save a str allocation per field per
+        # candidate; the fallback covers rows written before the columns
         query_lower = query.lower()
-        
-        if query_lower in medicine.brand_name.lower():
+
+        if query_lower in (medicine.brand_name_lc or medicine.brand_name.lower()):
             return medicine.brand_name
-        elif query_lower in medicine.generic_name.lower():
+        elif query_lower in (medicine.generic_name_lc or medicine.generic_name.lower()):
             return medicine.generic_name
-        elif query_lower in medicine.manufacturer.lower():
+        elif query_lower in (medicine.manufacturer_lc or medicine.manufacturer.lower()):
             return medicine.manufacturer
-        
+
         return ""
 
     def get_medicine_stats(self, db: Session) -> MedicineStats:
-        # Total medicines
-        total_medicines = db.query(func.count(Medicine.id)).scalar()
-
-        # Total manufacturers
-        total_manufacturers = db.query(func.count(func.distinct(Medicine.manufacturer))).scalar()
-
-        # Total generic names
-        total_generic_names = db.query(func.count(func.distinct(Medicine.generic_name))).scalar()
-
-        # Recent additions (last 30 days)
+        cached = _stats_cache.get("stats")
+        if cached is not None:
+            return cached
+
+        shared = _shared_cache_get(_STATS_KEY)
+        if shared is not None:
+            stats = MedicineStats(**shared)
+            _stats_cache["stats"] = stats
+            return stats
+
+        # All four scalar aggregates in a single scan and round-trip; the
+        # recent count rides along as a FILTER (WHERE ...) aggregate
         thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-        recent_additions = db.query(func.count(Medicine.id)).filter(
-            Medicine.created_at >= thirty_days_ago
-        ).scalar()
+        (
+            total_medicines,
+            total_manufacturers,
+            total_generic_names,
+            recent_additions,
+        ) = db.execute(
+            select(
+                func.count(Medicine.id),
+                func.count(func.distinct(Medicine.manufacturer)),
+                func.count(func.distinct(Medicine.generic_name)),
+                func.count(Medicine.id).filter(Medicine.created_at >= thirty_days_ago),
+            )
+        ).one()
 
         # Most searched terms
         most_searched = db.query(SearchLog.query, func.count(SearchLog.id)).group_by(
@@ -179,58 +425,67 @@ class MedicineService:
 
         most_searched_terms = [term for term, count in most_searched]
 
-        return MedicineStats(
+        stats = MedicineStats(
             total_medicines=total_medicines,
             total_manufacturers=total_manufacturers,
             total_generic_names=total_generic_names,
             recent_additions=recent_additions,
             most_searched=most_searched_terms
         )
+        _stats_cache["stats"] = stats
+        _shared_cache_set(_STATS_KEY, stats.dict(), ttl=300)
+        return stats
 
     def get_detailed_analytics(self, db: Session) -> Dict[str, Any]:
         """Get detailed analytics about medicines"""
-        # Basic stats
-        total_medicines = db.query(func.count(Medicine.id)).scalar()
-        
+        cached = _analytics_cache.get("analytics")
+        if cached is not None:
+            return cached
+
+        shared = _shared_cache_get(_ANALYTICS_KEY)
+        if shared is not None:
+            _analytics_cache["analytics"] = shared
+            return shared
+
+        # Basic stats - plain Core selects: these queries only feed dicts,
+        # so skipping Query/ORM construction is pure overhead removed
+        total_medicines = db.execute(select(func.count(Medicine.id))).scalar()
+
         # Medicines by manufacturer
-        medicines_by_manufacturer = db.query(
-            Medicine.manufacturer,
-            func.count(Medicine.id)
-        ).group_by(Medicine.manufacturer).order_by(
-            desc(func.count(Medicine.id))
-        ).limit(10).all()
-        
+        medicines_by_manufacturer = db.execute(
+            select(Medicine.manufacturer, func.count(Medicine.id).label('count'))
+            .group_by(Medicine.manufacturer)
+            .order_by(desc('count'))
+            .limit(10)
+        ).all()
+
         # Medicines by generic name
-        medicines_by_generic = db.query(
-            Medicine.generic_name,
-            func.count(Medicine.id)
-        ).group_by(Medicine.generic_name).order_by(
-            desc(func.count(Medicine.id))
-        ).limit(10).all()
-        
-        # Recent activity
+        medicines_by_generic = db.execute(
+            select(Medicine.generic_name, func.count(Medicine.id).label('count'))
+            .group_by(Medicine.generic_name)
+            .order_by(desc('count'))
+            .limit(10)
+        ).all()
+
+        # Search trends - the 7-day search total falls out of the same
+        # scan as the per-day buckets, saving a separate COUNT query
         seven_days_ago = datetime.utcnow() - timedelta(days=7)
-        recent_searches = db.query(func.count(SearchLog.id)).filter(
-            SearchLog.created_at >= seven_days_ago
-        ).scalar()
-        
-        recent_ocr_scans = db.query(func.count(OCRLog.id)).filter(
-            OCRLog.created_at >= seven_days_ago
-        ).scalar()
-        
-        # Search trends
-        search_trends = db.query(
-            func.date(SearchLog.created_at),
-            func.count(SearchLog.id)
-        ).filter(
-            SearchLog.created_at >= seven_days_ago
-        ).group_by(
-            func.date(SearchLog.created_at)
-        ).order_by(
-            func.date(SearchLog.created_at)
+        search_trends = db.execute(
+            select(
+                func.date(SearchLog.created_at).label('date'),
+                func.count(SearchLog.id).label('count')
+            )
+            .where(SearchLog.created_at >= seven_days_ago)
+            .group_by(func.date(SearchLog.created_at))
+            .order_by(func.date(SearchLog.created_at))
         ).all()
+        recent_searches = sum(count for _, count in search_trends)
+
+        recent_ocr_scans = db.execute(
+            select(func.count(OCRLog.id)).where(OCRLog.created_at >= seven_days_ago)
+        ).scalar()
         
-        return {
+        analytics = {
             "total_medicines": total_medicines,
             "medicines_by_manufacturer": [
                 {"manufacturer": m, "count": c} for m, c in medicines_by_manufacturer
@@ -246,6 +501,9 @@ class MedicineService:
                 {"date": str(date), "count": count} for date, count in search_trends
             ]
         }
+        _analytics_cache["analytics"] = analytics
+        _shared_cache_set(_ANALYTICS_KEY, analytics, ttl=60)
+        return analytics
 
     def log_search(self, db: Session, user_id: Optional[int], query: str, search_type: str = "text", results_count: int = 0, confidence_score: Optional[float] = None):
         """Log a search query"""
@@ -275,19 +533,43 @@ class MedicineService:
         popular_queries = db.query(SearchLog.query, func.count(SearchLog.id)).group_by(
             SearchLog.query
         ).order_by(desc(func.count(SearchLog.id))).limit(limit).all()
-        
+
+        queries = [query for query, _ in popular_queries]
+        if not queries:
+            return []
+
+        # Two round-trips total instead of up to two per term: one IN()
+        # over barcodes, one OR of prefix patterns (indexable, unlike the
+        # old '%q%' form) for the terms that weren't barcodes
+        by_barcode = {
+            m.barcode: m
+            for m in db.query(Medicine).filter(Medicine.barcode.in_(queries)).all()
+        }
+
+        missing = [query for query in queries if query not in by_barcode]
+        name_candidates = []
+        if missing:
+            name_candidates = db.query(Medicine).filter(
+                or_(*[Medicine.brand_name.ilike(f"{query}%") for query in missing])
+            ).all()
+
+        # Reassemble in popularity order, deduplicating by id
         medicines = []
-        for query, _ in popular_queries:
-            medicine = self.get_medicine_by_barcode(db, query)
-            if not medicine:
-                # Try to find by name
-                medicine = db.query(Medicine).filter(
-                    Medicine.brand_name.ilike(f"%{query}%")
-                ).first()
-            
-            if medicine and medicine not in medicines:
+        seen_ids = set()
+        for query in queries:
+            medicine = by_barcode.get(query)
+            if medicine is None:
+                query_lower = query.lower()
+                for candidate in name_candidates:
+                    brand_lower = candidate.brand_name_lc or candidate.brand_name.lower()
+                    if brand_lower.startswith(query_lower):
+                        medicine = candidate
+                        break
+
+            if medicine is not None and medicine.id not in seen_ids:
+                seen_ids.add(medicine.id)
                 medicines.append(medicine)
-        
+
         return medicines[:limit]
 
     def get_medicines_by_manufacturer(self, db: Session, manufacturer: str, limit: int = 50) -> List[Medicine]:
@@ -313,18 +595,10 @@ class MedicineService:
         if not barcode:
             return True  # Barcode is optional
         
-        # Basic validation for common barcode formats
-        # Remove spaces and dashes
-        clean_barcode = re.sub(r'[\s-]', '', barcode)
-        
-        # Check if it's numeric and has reasonable length
-        if not clean_barcode.isdigit():
-            return False
-        
-        if len(clean_barcode) < 8 or len(clean_barcode) > 13:
-            return False
-        
-        return True
+        # Basic validation for common barcode formats: strip spaces and
+        # dashes, then require 8-13 digits
+        clean_barcode = barcode.translate(_BARCODE_STRIP)
+        return _BARCODE_RE.fullmatch(clean_barcode) is not None
 
     def check_duplicate_medicine(self, db: Session, medicine: MedicineCreate, exclude_id: Optional[int] = None) -> bool:
         """Check if a medicine already exists"""
@@ -343,40 +617,48 @@ class MedicineService:
         return query.first() is not None
 
     def bulk_create_medicines(self, db: Session, medicines: List[MedicineCreate], user_id: int) -> List[Medicine]:
-        db_medicines = []
+        rows = []
         for medicine in medicines:
-            db_medicine = Medicine(
-                brand_name=medicine.brand_name,
-                generic_name=medicine.generic_name,
-                strength=medicine.strength,
-                manufacturer=medicine.manufacturer,
-                uses=medicine.uses,
-                side_effects=medicine.side_effects,
-                warnings=medicine.warnings,
-                barcode=medicine.barcode,
-                image_url=medicine.image_url,
-                created_by=user_id
-            )
-            db_medicines.append(db_medicine)
-
-        db.add_all(db_medicines)
+            row = medicine.dict()
+            row["created_by"] = user_id
+            # Core executemany bypasses the mapper events, so the shadow
+            # columns are filled here
+            row["brand_name_lc"] = (row["brand_name"] or "").lower()
+            row["generic_name_lc"] = (row["generic_name"] or "").lower()
+            row["manufacturer_lc"] = (row["manufacturer"] or "").lower()
+            rows.append(row)
+
+        # Single executemany INSERT instead of add_all: no identity-map
+        # bookkeeping per object, and RETURNING hands back the generated
+        # IDs in the same round-trips (insertmanyvalues batches it on
+        # both SQLite and Postgres)
+        result = db.execute(insert(Medicine).returning(Medicine.id), rows)
+        ids = [row[0] for row in result]
         db.commit()
-        
-        for medicine in db_medicines:
-            db.refresh(medicine)
-        
-        return db_medicines
 
-    async def import_from_csv(self, db: Session, file) -> Dict[str, Any]:
-        content = await file.read()
-        content = content.decode('utf-8')
-        
-        csv_reader = csv.DictReader(io.StringIO(content))
-        
+        self._invalidate_caches()
+        # One IN-list re-select replaces the old per-row refresh loop
+        return db.query(Medicine).filter(Medicine.id.in_(ids)).all()
+
+    def import_from_csv(self, db: Session, content) -> Dict[str, Any]:
+        # Accepts raw bytes or a binary file object. The file path streams
+        # line by line through an incremental decoder, keeping memory at
+        # O(row) instead of holding the upload twice (bytes + decoded str)
+        if isinstance(content, bytes):
+            stream = io.StringIO(content.decode('utf-8'))
+        else:
+            content.seek(0)
+            stream = io.TextIOWrapper(content, encoding='utf-8', newline='')
+
+        csv_reader = csv.DictReader(stream)
+
         successful_imports = 0
         failed_imports = 0
         errors = []
 
+        # Pass 1: parse and validate in memory; no DB work per row
+        parsed = []
+        keys = []
         for row_num, row in enumerate(csv_reader, start=2):  # Start from 2 to account for header
             try:
                 medicine = MedicineCreate(
@@ -390,40 +672,96 @@ class MedicineService:
                     barcode=row.get('barcode', '').strip() or None,
                     image_url=row.get('image_url', '').strip() or None
                 )
-                
+
                 # Validate barcode
                 if medicine.barcode and not self.validate_barcode(medicine.barcode):
                     errors.append(f"Row {row_num}: Invalid barcode format")
                     failed_imports += 1
                     continue
-                
-                # Check if medicine already exists
-                if self.check_duplicate_medicine(db, medicine):
-                    errors.append(f"Row {row_num}: Medicine already exists")
-                    failed_imports += 1
-                    continue
 
-                db_medicine = Medicine(
-                    brand_name=medicine.brand_name,
-                    generic_name=medicine.generic_name,
-                    strength=medicine.strength,
-                    manufacturer=medicine.manufacturer,
-                    uses=medicine.uses,
-                    side_effects=medicine.side_effects,
-                    warnings=medicine.warnings,
-                    barcode=medicine.barcode,
-                    image_url=medicine.image_url
-                )
-                
-                db.add(db_medicine)
-                successful_imports += 1
-                
+                parsed.append((row_num, medicine))
+                keys.append((medicine.brand_name, medicine.generic_name,
+                             medicine.strength, medicine.manufacturer))
+
             except Exception as e:
                 errors.append(f"Row {row_num}: {str(e)}")
                 failed_imports += 1
 
+        # One batched duplicate probe instead of a SELECT per row; chunked
+        # so the IN-list stays within statement limits on huge CSVs. Past
+        # a few thousand keys, pulling the whole catalog key set in one
+        # scan is cheaper than the pile of IN-list probes.
+        seen = set()
+        if len(keys) > 5000:
+            seen.update(
+                tuple(row) for row in db.execute(
+                    select(
+                        Medicine.brand_name, Medicine.generic_name,
+                        Medicine.strength, Medicine.manufacturer
+                    )
+                ).all()
+            )
+        else:
+            for start in range(0, len(keys), 1000):
+                seen.update(
+                    tuple(row) for row in db.query(
+                        Medicine.brand_name, Medicine.generic_name,
+                        Medicine.strength, Medicine.manufacturer
+                    ).filter(
+                        tuple_(
+                            Medicine.brand_name, Medicine.generic_name,
+                            Medicine.strength, Medicine.manufacturer
+                        ).in_(keys[start:start + 1000])
+                    ).all()
+                )
+
+        # No synchronous=OFF juggling here: the session's connection goes
+        # back to the pool at every chunk commit, so the weakened pragma
+        # could be picked up by unrelated request handlers and the
+        # restore could land on a different connection. WAL plus the
+        # engine-level synchronous=NORMAL already make the chunked
+        # commits cheap (one fsync per 1000 rows).
+        batch = []
+        for row_num, medicine in parsed:
+            key = (medicine.brand_name, medicine.generic_name,
+                   medicine.strength, medicine.manufacturer)
+            if key in seen:
+                errors.append(f"Row {row_num}: Medicine already exists")
+                failed_imports += 1
+                continue
+            seen.add(key)
+
+            # Core executemany bypasses the mapper events, so the
+            # lowercase shadows are filled in here
+            batch.append({
+                "brand_name": medicine.brand_name,
+                "generic_name": medicine.generic_name,
+                "strength": medicine.strength,
+                "manufacturer": medicine.manufacturer,
+                "uses": medicine.uses,
+                "side_effects": medicine.side_effects,
+                "warnings": medicine.warnings,
+                "barcode": medicine.barcode,
+                "image_url": medicine.image_url,
+                "brand_name_lc": medicine.brand_name.lower(),
+                "generic_name_lc": medicine.generic_name.lower(),
+                "manufacturer_lc": medicine.manufacturer.lower()
+            })
+            successful_imports += 1
+
+            # Insert and commit in chunks: executemany keeps each chunk
+            # to one statement, committing caps the transaction size
+            if len(batch) >= 1000:
+                db.execute(insert(Medicine), batch)
+                db.commit()
+                batch.clear()
+
+        if batch:
+            db.execute(insert(Medicine), batch)
         db.commit()
-        
+
+        self._invalidate_caches()
+
         return {
             "total_records": successful_imports + failed_imports,
             "successful_imports": successful_imports,
@@ -431,35 +769,50 @@ class MedicineService:
             "errors": errors
         }
 
+    @staticmethod
+    def _medicine_payload(medicine: Medicine) -> Dict[str, Any]:
+        """Serializable dict for the cloud sync/backup paths"""
+        return {
+            "id": medicine.id,
+            "brand_name": medicine.brand_name,
+            "generic_name": medicine.generic_name,
+            "strength": medicine.strength,
+            "manufacturer": medicine.manufacturer,
+            "uses": medicine.uses,
+            "side_effects": medicine.side_effects,
+            "warnings": medicine.warnings,
+            "barcode": medicine.barcode,
+            "image_url": medicine.image_url,
+            # Raw datetimes: Firestore stores them as native timestamps,
+            # so there is no isoformat() per row on the way out
+            "created_at": medicine.created_at,
+            "updated_at": medicine.updated_at
+        }
+
     async def sync_to_cloud(self, db: Session) -> Dict[str, Any]:
         try:
-            medicines = db.query(Medicine).all()
-            medicine_data = []
-            
-            for medicine in medicines:
-                medicine_data.append({
-                    "id": medicine.id,
-                    "brand_name": medicine.brand_name,
-                    "generic_name": medicine.generic_name,
-                    "strength": medicine.strength,
-                    "manufacturer": medicine.manufacturer,
-                    "uses": medicine.uses,
-                    "side_effects": medicine.side_effects,
-                    "warnings": medicine.warnings,
-                    "barcode": medicine.barcode,
-                    "image_url": medicine.image_url,
-                    "created_at": medicine.created_at.isoformat(),
-                    "updated_at": medicine.updated_at.isoformat() if medicine.updated_at else None
-                })
-            
-            await self.firebase_service.upload_medicines(medicine_data)
-            
+            # Stream rows in server-side chunks instead of materializing
+            # the whole catalog twice (ORM list + dict list); each batch
+            # uploads while the next is being hydrated
+            records_synced = 0
+            batch = []
+            for medicine in db.query(Medicine).yield_per(1000):
+                batch.append(self._medicine_payload(medicine))
+                if len(batch) >= 1000:
+                    await self.firebase_service.upload_medicines(batch)
+                    records_synced += len(batch)
+                    batch = []
+
+            if batch:
+                await self.firebase_service.upload_medicines(batch)
+                records_synced += len(batch)
+
             return {
                 "status": "success",
-                "records_synced": len(medicine_data),
+                "records_synced": records_synced,
                 "message": "Data successfully synced to cloud"
             }
-            
+
         except Exception as e:
             return {
                 "status": "failed",
@@ -467,48 +820,81 @@ class MedicineService:
                 "message": "Failed to sync data to cloud"
             }
 
+    @staticmethod
+    def _parse_cloud_dt(value) -> Optional[datetime]:
+        """Firestore hands back native timestamps (datetime subclasses);
+        only payloads written before the raw-datetime switch arrive as
+        ISO strings and need the parse."""
+        if value is None or isinstance(value, datetime):
+            return value
+        return datetime.fromisoformat(value)
+
+    @staticmethod
+    def _medicine_row(medicine_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Flat column dict from a cloud payload, for executemany/upsert.
+
+        The lowercase shadows are filled here because Core statements
+        bypass the mapper events that normally maintain them.
+        """
+        return {
+            "id": medicine_data["id"],
+            "brand_name": medicine_data["brand_name"],
+            "generic_name": medicine_data["generic_name"],
+            "strength": medicine_data["strength"],
+            "manufacturer": medicine_data["manufacturer"],
+            "uses": medicine_data["uses"],
+            "side_effects": medicine_data["side_effects"],
+            "warnings": medicine_data["warnings"],
+            "barcode": medicine_data.get("barcode"),
+            "image_url": medicine_data.get("image_url"),
+            "brand_name_lc": (medicine_data["brand_name"] or "").lower(),
+            "generic_name_lc": (medicine_data["generic_name"] or "").lower(),
+            "manufacturer_lc": (medicine_data["manufacturer"] or "").lower(),
+            "created_at": MedicineService._parse_cloud_dt(medicine_data["created_at"]),
+            "updated_at": MedicineService._parse_cloud_dt(medicine_data.get("updated_at"))
+        }
+
+    # Columns refreshed when an upsert hits an existing id
+    _UPSERT_COLUMNS = (
+        "brand_name", "generic_name", "strength", "manufacturer", "uses",
+        "side_effects", "warnings", "barcode", "image_url",
+        "brand_name_lc", "generic_name_lc", "manufacturer_lc",
+        "created_at", "updated_at",
+    )
+
     async def sync_from_cloud(self, db: Session) -> Dict[str, Any]:
         try:
             cloud_medicines = await self.firebase_service.download_medicines()
-            
+
+            # One INSERT .. ON CONFLICT DO UPDATE per 1000 rows replaces
+            # the old per-row SELECT-then-insert-or-update (2N statements)
+            values = [self._medicine_row(m) for m in cloud_medicines]
+            insert_fn = (
+                postgresql.insert
+                if db.get_bind().dialect.name == "postgresql"
+                else sqlite.insert
+            )
+
             synced_count = 0
-            for medicine_data in cloud_medicines:
-                # Check if medicine exists
-                existing = db.query(Medicine).filter(Medicine.id == medicine_data["id"]).first()
-                
-                if existing:
-                    # Update existing medicine
-                    for key, value in medicine_data.items():
-                        if key != "id" and hasattr(existing, key):
-                            setattr(existing, key, value)
-                else:
-                    # Create new medicine
-                    medicine = Medicine(
-                        id=medicine_data["id"],
-                        brand_name=medicine_data["brand_name"],
-                        generic_name=medicine_data["generic_name"],
-                        strength=medicine_data["strength"],
-                        manufacturer=medicine_data["manufacturer"],
-                        uses=medicine_data["uses"],
-                        side_effects=medicine_data["side_effects"],
-                        warnings=medicine_data["warnings"],
-                        barcode=medicine_data.get("barcode"),
-                        image_url=medicine_data.get("image_url"),
-                        created_at=datetime.fromisoformat(medicine_data["created_at"]),
-                        updated_at=datetime.fromisoformat(medicine_data["updated_at"]) if medicine_data.get("updated_at") else None
-                    )
-                    db.add(medicine)
-                
-                synced_count += 1
-            
+            for start in range(0, len(values), 1000):
+                chunk = values[start:start + 1000]
+                stmt = insert_fn(Medicine).values(chunk)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=["id"],
+                    set_={c: stmt.excluded[c] for c in self._UPSERT_COLUMNS},
+                )
+                db.execute(stmt)
+                synced_count += len(chunk)
+
             db.commit()
-            
+            self._invalidate_caches()
+
             return {
                 "status": "success",
                 "records_synced": synced_count,
                 "message": "Data successfully synced from cloud"
             }
-            
+
         except Exception as e:
             return {
                 "status": "failed",
@@ -519,25 +905,13 @@ class MedicineService:
     async def backup_to_cloud(self, db: Session) -> Dict[str, Any]:
         """Create a backup of the database in the cloud"""
         try:
-            medicines = db.query(Medicine).all()
-            medicine_data = []
-            
-            for medicine in medicines:
-                medicine_data.append({
-                    "id": medicine.id,
-                    "brand_name": medicine.brand_name,
-                    "generic_name": medicine.generic_name,
-                    "strength": medicine.strength,
-                    "manufacturer": medicine.manufacturer,
-                    "uses": medicine.uses,
-                    "side_effects": medicine.side_effects,
-                    "warnings": medicine.warnings,
-                    "barcode": medicine.barcode,
-                    "image_url": medicine.image_url,
-                    "created_at": medicine.created_at.isoformat(),
-                    "updated_at": medicine.updated_at.isoformat() if medicine.updated_at else None
-                })
-            
+            # The backup document is written in one shot, but streaming the
+            # read at least avoids holding a second full ORM copy
+            medicine_data = [
+                self._medicine_payload(medicine)
+                for medicine in db.query(Medicine).yield_per(1000)
+            ]
+
             success = await self.firebase_service.backup_database(medicine_data)
             
             if success:
@@ -570,31 +944,25 @@ class MedicineService:
                     "message": "No backup found in cloud"
                 }
             
-            # Clear existing data
-            db.query(Medicine).delete()
-            
-            # Restore from backup
+            # Clear existing data - TRUNCATE skips per-row delete work and
+            # resets the id sequence; SQLite has no TRUNCATE, but its
+            # unqualified DELETE takes the equivalent fast path
+            if db.get_bind().dialect.name == "postgresql":
+                db.execute(text("TRUNCATE medicines RESTART IDENTITY CASCADE"))
+            else:
+                db.query(Medicine).delete()
+
+            # Restore from backup with chunked executemany inserts
+            rows = [self._medicine_row(data) for data in medicine_data]
             restored_count = 0
-            for data in medicine_data:
-                medicine = Medicine(
-                    id=data["id"],
-                    brand_name=data["brand_name"],
-                    generic_name=data["generic_name"],
-                    strength=data["strength"],
-                    manufacturer=data["manufacturer"],
-                    uses=data["uses"],
-                    side_effects=data["side_effects"],
-                    warnings=data["warnings"],
-                    barcode=data.get("barcode"),
-                    image_url=data.get("image_url"),
-                    created_at=datetime.fromisoformat(data["created_at"]),
-                    updated_at=datetime.fromisoformat(data["updated_at"]) if data.get("updated_at") else None
-                )
-                db.add(medicine)
-                restored_count += 1
-            
+            for start in range(0, len(rows), 1000):
+                chunk = rows[start:start + 1000]
+                db.execute(insert(Medicine), chunk)
+                restored_count += len(chunk)
+
             db.commit()
-            
+            self._invalidate_caches()
+
             return {
                 "status": "success",
                 "records_restored": restored_count,
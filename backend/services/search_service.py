@@ -1,27 +1,81 @@
 from sqlalchemy.orm import Session
 from typing import List, Dict, Any
-from fuzzywuzzy import fuzz, process
+from rapidfuzz import fuzz, process
+import time
+
+from database.models import Medicine
 from services.medicine_service import MedicineService
 from services.ocr_service import OCRService
 
+# Cached (id, searchable-name) view of the catalog so fuzzy search scores
+# against an in-memory list instead of re-querying and re-joining names on
+# every request; rebuilt at most once per minute
+_FUZZY_CATALOG_TTL = 60.0
+_fuzzy_catalog = {"built_at": 0.0, "ids": (), "choices": ()}
+
 class SearchService:
     def __init__(self):
         self.medicine_service = MedicineService()
         self.ocr_service = OCRService()
 
+    def _get_fuzzy_catalog(self, db: Session):
+        now = time.monotonic()
+        if now - _fuzzy_catalog["built_at"] > _FUZZY_CATALOG_TTL:
+            rows = db.query(Medicine.id, Medicine.brand_name, Medicine.generic_name).all()
+            _fuzzy_catalog["ids"] = tuple(row[0] for row in rows)
+            _fuzzy_catalog["choices"] = tuple(f"{row[1]} {row[2]}" for row in rows)
+            _fuzzy_catalog["built_at"] = now
+        return _fuzzy_catalog["ids"], _fuzzy_catalog["choices"]
+
     def search_medicines(self, db: Session, query: str, limit: int = 10) -> List[Dict[str, Any]]:
         """Basic search medicines by text"""
         medicines = self.medicine_service.search_medicines(db, query, limit)
+        # Prefetch: the next request is almost always the detail page for
+        # one of these results
+        self.medicine_service.warm_detail_cache(medicines)
         return [self._format_medicine_result(medicine) for medicine in medicines]
 
     def fuzzy_search_medicines(self, db: Session, query: str, limit: int = 10) -> List[Dict[str, Any]]:
         """Fuzzy search medicines with confidence scoring"""
-        results = self.medicine_service.search_medicines_with_confidence(db, query, limit)
-        return [self._format_search_result(result) for result in results]
+        ids, choices = self._get_fuzzy_catalog(db)
+
+        # One vectorized C call over the whole catalog instead of a Python
+        # scoring loop per row
+        matches = process.extract(
+            query, choices, scorer=fuzz.WRatio, limit=limit, score_cutoff=60
+        )
+        if not matches:
+            return []
+
+        match_ids = [ids[index] for _, _, index in matches]
+        medicines = db.query(Medicine).filter(Medicine.id.in_(match_ids)).all()
+        medicines_by_id = {medicine.id: medicine for medicine in medicines}
+
+        # Build the response dicts directly - the old flow built an
+        # intermediate result dict per match and then re-walked the list
+        # through _format_search_result
+        fmt = self._format_medicine_result
+        hit_medicines = []
+        results = []
+        for choice, score, index in matches:
+            medicine = medicines_by_id.get(ids[index])
+            if medicine is None:  # deleted since the catalog was built
+                continue
+            hit_medicines.append(medicine)
+            results.append({
+                "medicine": fmt(medicine),
+                "confidence_score": score / 100,
+                "matched_text": choice,
+                "match_type": "fuzzy"
+            })
+
+        self.medicine_service.warm_detail_cache(hit_medicines)
+        return results
 
     def search_by_ocr_text(self, db: Session, text: str, limit: int = 10) -> List[Dict[str, Any]]:
         """Search medicines using OCR extracted text"""
         results = self.ocr_service.search_medicines_by_ocr_text(db, text, limit)
+        self.medicine_service.warm_detail_cache([result['medicine'] for result in results])
         return [self._format_ocr_result(result) for result in results]
 
     def search_by_barcode(self, db: Session, barcode: str) -> Dict[str, Any]:
@@ -73,8 +127,8 @@ class SearchService:
             "warnings": medicine.warnings,
             "barcode": medicine.barcode,
             "image_url": medicine.image_url,
-            "created_at": medicine.created_at.isoformat() if medicine.created_at else None,
-            "updated_at": medicine.updated_at.isoformat() if medicine.updated_at else None
+            "created_at": medicine.created_at_iso,
+            "updated_at": medicine.updated_at_iso
         }
 
     def _format_search_result(self, result: Dict[str, Any]) -> Dict[str, Any]:
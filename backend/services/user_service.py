@@ -1,23 +1,144 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import func, desc
+from sqlalchemy.orm import Session, load_only
+from sqlalchemy import func, desc, update, insert, select, literal, union_all, bindparam, tuple_, text
+from functools import lru_cache
 from typing import List, Optional, Dict, Any
 from datetime import datetime, timedelta
 import hashlib
+import os
 import secrets
+import threading
+import time
 
-from database.models import User, Medicine, SearchLog, OCRLog
+from database.models import User, Medicine, SearchLog, OCRLog, ApiKey
 from schemas.user import UserCreate, UserUpdate, UserResponse, UserStats
+from cachetools import TTLCache
 from passlib.context import CryptContext
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt cost factor: passlib's default of 12 costs ~250ms per hash/verify;
+# 11 lands near a 100-150ms budget on typical deployment hardware. Use
+# calibrate_bcrypt_rounds() to pick a value for a new target machine.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "11"))
+
+# Argon2id for new hashes: memory-hard against GPU/ASIC attacks and the
+# backing argon2-cffi releases the GIL during the long compute, so
+# concurrent logins actually run in parallel. Existing bcrypt hashes
+# keep verifying and are transparently re-hashed on successful login.
+pwd_context = CryptContext(
+    schemes=["argon2", "bcrypt"],
+    deprecated=["bcrypt"],
+    argon2__time_cost=2,
+    argon2__memory_cost=64 * 1024,
+    argon2__parallelism=os.cpu_count() or 1,
+    bcrypt__rounds=BCRYPT_ROUNDS,
+    bcrypt__ident="2b",
+)
+
+def calibrate_bcrypt_rounds(max_hash_ms: int = 150) -> int:
+    """Pick the largest bcrypt cost whose hash time fits the budget.
+
+    One-shot utility: run it on the deployment hardware and set the
+    BCRYPT_ROUNDS env var to the returned value.
+    """
+    best = 10
+    for rounds in range(10, 15):
+        probe = CryptContext(schemes=["bcrypt"], bcrypt__rounds=rounds)
+        start = time.perf_counter()
+        probe.hash("calibration-probe")
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if elapsed_ms > max_hash_ms:
+            break
+        best = rounds
+    return best
+
+def _calibrate_argon2_time_cost(target_ms: int) -> int:
+    """Smallest argon2 time_cost whose hash time reaches the target on
+    this host - the same idea as calibrate_bcrypt_rounds for the primary
+    scheme"""
+    for time_cost in range(1, 10):
+        probe = CryptContext(
+            schemes=["argon2"],
+            argon2__time_cost=time_cost,
+            argon2__memory_cost=64 * 1024,
+            argon2__parallelism=os.cpu_count() or 1,
+        )
+        start = time.perf_counter()
+        probe.hash("calibration-probe")
+        if (time.perf_counter() - start) * 1000 >= target_ms:
+            return time_cost
+    return 10
+
+# Opt-in startup calibration: with KDF_TARGET_MS set, the argon2
+# time_cost is measured on the booting host and adjusted toward the
+# target, so a fast box does not under-spend its security budget and a
+# cheap VPS does not blow the login latency budget. Off by default - it
+# costs a few probe hashes at import, and pinning cost to whichever
+# machine boots first is wrong for heterogeneous fleets; those should
+# set the parameters explicitly instead.
+_KDF_TARGET_MS = int(os.getenv("KDF_TARGET_MS", "0"))
+if _KDF_TARGET_MS:
+    pwd_context.update(argon2__time_cost=_calibrate_argon2_time_cost(_KDF_TARGET_MS))
+
+# Snapshot cache for the per-request auth lookup: every authenticated
+# request resolves the token's username to a User row, and that metadata
+# is effectively immutable on a 30-second horizon. Entries are detached
+# User snapshots carrying only the fields the request path reads.
+_username_cache = TTLCache(maxsize=50_000, ttl=30)
+_username_cache_lock = threading.Lock()
+
+# Verification results for the KDF hot path: verify is deterministic, so
+# a repeat check of the same credentials within the window is a dict
+# lookup instead of a ~100ms KDF run. Keys pair the stored hash with a
+# SHA-256 digest of the plaintext (never the plaintext itself), and the
+# short TTL bounds how long a result can outlive a password change.
+# Appropriate for repeat-auth flows; token verification has its own cache.
+_verify_cache = TTLCache(maxsize=4096, ttl=60)
+_verify_cache_lock = threading.Lock()
+
+# Keyed BLAKE2 digests for API keys. The key turns the digest into a
+# MAC, so a leaked api_keys table cannot be matched offline against
+# guessed keys. blake2b is in the stdlib and SIMD-fast; the blake3
+# package would add a dependency for no measurable win at this call rate.
+_API_KEY_SECRET = os.getenv("API_KEY_SECRET", os.getenv("SECRET_KEY", "your-secret-key-here")).encode()
+
+def _api_key_digest(api_key: str) -> str:
+    return hashlib.blake2b(
+        api_key.encode(), key=_API_KEY_SECRET[:64], digest_size=32
+    ).hexdigest()
+
+# Columns the listing endpoints actually serialize. load_only with these
+# keeps hashed_password (and its 255-byte string) out of every listed
+# row's fetch and identity-map entry; anything that verifies credentials
+# loads the full row through the single-user getters instead.
+USER_PUBLIC_COLS = (
+    User.id, User.username, User.email,
+    User.is_active, User.is_admin, User.created_at, User.updated_at,
+)
+
+# Dashboard stats: the COUNT(*) aggregates grow with per-user history,
+# so polling clients get the cached tuple and the scans run at most once
+# per minute per user
+_user_stats_cache = TTLCache(maxsize=10_000, ttl=60)
+
+def _verify_cached(plain_password: str, hashed_password: str) -> bool:
+    key = (hashed_password, hashlib.sha256(plain_password.encode()).digest())
+    with _verify_cache_lock:
+        hit = _verify_cache.get(key)
+    if hit is not None:
+        return hit
+    result = pwd_context.verify(plain_password, hashed_password)
+    with _verify_cache_lock:
+        _verify_cache[key] = result
+    return result
 
 class UserService:
     def __init__(self):
         pass
 
     def get_users(self, db: Session, skip: int = 0, limit: int = 100) -> List[User]:
-        """Get all users with pagination"""
-        return db.query(User).offset(skip).limit(limit).all()
+        """Get all users with pagination (public columns only)"""
+        return db.query(User).options(
+            load_only(*USER_PUBLIC_COLS)
+        ).offset(skip).limit(limit).all()
 
     def get_user(self, db: Session, user_id: int) -> Optional[User]:
         """Get user by ID"""
@@ -31,22 +152,108 @@ class UserService:
         """Get user by username"""
         return db.query(User).filter(User.username == username).first()
 
+    def get_user_by_username_cached(self, db: Session, username: str) -> Optional[User]:
+        """Cached username lookup for the auth hot path.
+
+        Returns a detached User snapshot carrying the UserResponse fields
+        (no hashed_password) so a cache hit skips the DB round-trip
+        entirely. Callers that mutate the user must use
+        get_user_by_username.
+        """
+        with _username_cache_lock:
+            snapshot = _username_cache.get(username)
+        if snapshot is not None:
+            return snapshot
+
+        db_user = self.get_user_by_username(db, username)
+        if db_user is None:
+            return None
+
+        snapshot = User(
+            id=db_user.id,
+            username=db_user.username,
+            email=db_user.email,
+            is_active=db_user.is_active,
+            is_admin=db_user.is_admin,
+            # UserResponse requires the timestamps, so the snapshot must
+            # carry everything the response schema serializes
+            created_at=db_user.created_at,
+            updated_at=db_user.updated_at,
+        )
+        with _username_cache_lock:
+            _username_cache[username] = snapshot
+        return snapshot
+
+    def _invalidate_username_cache(self, username: Optional[str]) -> None:
+        """Drop a cached snapshot after a mutation so the TTL is an upper
+        bound on staleness, not the common case"""
+        if username is None:
+            return
+        with _username_cache_lock:
+            _username_cache.pop(username, None)
+
     def create_user(self, db: Session, user: UserCreate) -> User:
-        """Create a new user"""
+        """Create a new user.
+
+        INSERT ... RETURNING instead of add/commit/refresh: the refresh
+        round-trip only existed to read back the server-generated id and
+        created_at, which RETURNING hands over from the INSERT itself.
+        """
         # Hash the password
         hashed_password = pwd_context.hash(user.password)
-        
-        db_user = User(
+
+        row = db.execute(
+            insert(User).values(
+                username=user.username,
+                email=user.email,
+                hashed_password=hashed_password,
+                is_active=True,
+                is_admin=False,
+            ).returning(User.id, User.created_at)
+        ).one()
+        db.commit()
+
+        # Detached snapshot assembled from values already in hand plus
+        # the RETURNING row - nothing left for a refresh to fetch
+        return User(
+            id=row.id,
             username=user.username,
             email=user.email,
             hashed_password=hashed_password,
             is_active=True,
-            is_admin=False
+            is_admin=False,
+            created_at=row.created_at,
         )
-        db.add(db_user)
+
+    def create_users_bulk(self, db: Session, users: List[UserCreate]) -> List[User]:
+        """Create many users in one INSERT (import/seed path).
+
+        Hashing still runs once per password - that cost is the point of
+        the KDF - but the rows land as a single executemany with one
+        commit instead of N add/commit/refresh cycles.
+        """
+        hashes = [pwd_context.hash(u.password) for u in users]
+        rows = [
+            {
+                "username": u.username,
+                "email": u.email,
+                "hashed_password": h,
+                "is_active": True,
+                "is_admin": False,
+            }
+            for u, h in zip(users, hashes)
+        ]
+        result = db.execute(
+            insert(User).returning(
+                User.id, User.created_at, sort_by_parameter_order=True
+            ),
+            rows,
+        ).all()
         db.commit()
-        db.refresh(db_user)
-        return db_user
+        return [
+            User(id=row.id, created_at=row.created_at, **fields)
+            for row, fields in zip(result, rows)
+        ]
 
     def update_user(self, db: Session, user_id: int, user: UserUpdate) -> Optional[User]:
         """Update user information"""
@@ -54,8 +261,9 @@ class UserService:
         if not db_user:
             return None
 
+        old_username = db_user.username
         update_data = user.dict(exclude_unset=True)
-        
+
         # Hash password if it's being updated
         if 'password' in update_data:
             update_data['hashed_password'] = pwd_context.hash(update_data.pop('password'))
@@ -66,6 +274,8 @@ class UserService:
         db_user.updated_at = datetime.utcnow()
         db.commit()
         db.refresh(db_user)
+        self._invalidate_username_cache(old_username)
+        self._invalidate_username_cache(db_user.username)
         return db_user
 
     def delete_user(self, db: Session, user_id: int) -> bool:
@@ -74,28 +284,53 @@ class UserService:
         if not db_user:
             return False
 
+        username = db_user.username
         db.delete(db_user)
         db.commit()
+        self._invalidate_username_cache(username)
         return True
 
     def authenticate_user(self, db: Session, username: str, password: str) -> Optional[User]:
         """Authenticate user with username/email and password"""
-        # Try to find user by username or email
-        user = db.query(User).filter(
-            (User.username == username) | (User.email == username)
-        ).first()
-        
-        if not user:
+        # Credential probe fetches only what verification needs - the
+        # full row (and its 255-byte hash column staying resident in the
+        # identity map) is loaded just once, on success. Dispatch on the
+        # identifier shape instead of an OR filter the planner cannot
+        # serve from a single index: an email must contain '@' and falls
+        # back to the username probe only on a miss, so the common case
+        # is one unique-index lookup
+        cols = (User.id, User.username, User.hashed_password)
+        if '@' in username:
+            row = (db.query(*cols).filter(User.email == username).first()
+                   or db.query(*cols).filter(User.username == username).first())
+        else:
+            row = db.query(*cols).filter(User.username == username).first()
+
+        if row is None:
+            # Burn the KDF cost anyway: a missing user and a wrong
+            # password then take the same time, which closes the
+            # username-enumeration timing channel and gives the auth
+            # path one cost for capacity planning
+            pwd_context.dummy_verify()
             return None
-        
-        if not pwd_context.verify(password, user.hashed_password):
+
+        valid, new_hash = pwd_context.verify_and_update(password, row.hashed_password)
+        if not valid:
             return None
-        
+
+        user = self.get_user(db, row.id)
+
+        # Legacy bcrypt hash verified - upgrade it to argon2id in place
+        if new_hash and user is not None:
+            user.hashed_password = new_hash
+            db.commit()
+            self._invalidate_username_cache(user.username)
+
         return user
 
     def verify_password(self, plain_password: str, hashed_password: str) -> bool:
-        """Verify a password against its hash"""
-        return pwd_context.verify(plain_password, hashed_password)
+        """Verify a password against its hash (cached, see _verify_cached)"""
+        return _verify_cached(plain_password, hashed_password)
 
     def get_password_hash(self, password: str) -> str:
         """Generate password hash"""
@@ -113,91 +348,109 @@ class UserService:
         user.hashed_password = pwd_context.hash(new_password)
         user.updated_at = datetime.utcnow()
         db.commit()
+        self._invalidate_username_cache(user.username)
         return True
 
-    def activate_user(self, db: Session, user_id: int) -> bool:
-        """Activate a user account"""
-        user = db.query(User).filter(User.id == user_id).first()
-        if not user:
-            return False
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _flag_update_stmt(flags: tuple):
+        """Compile each toggle's UPDATE once; only the id and timestamp
+        vary per call, so they are bound parameters and the compiled form
+        stays hot in the statement cache"""
+        return (
+            update(User)
+            .where(User.id == bindparam("uid"))
+            .values(updated_at=bindparam("ts"), **dict(flags))
+            .returning(User.username)
+        )
 
-        user.is_active = True
-        user.updated_at = datetime.utcnow()
+    def _set_user_flags(self, db: Session, user_id: int, **values) -> bool:
+        """One UPDATE ... RETURNING instead of SELECT-then-UPDATE.
+
+        The toggles never read the row, so the prior SELECT only served
+        to check existence and fetch the username for cache invalidation;
+        RETURNING provides both from the same statement.
+        """
+        stmt = self._flag_update_stmt(tuple(sorted(values.items())))
+        row = db.execute(stmt, {"uid": user_id, "ts": datetime.utcnow()}).first()
         db.commit()
+        if row is None:
+            return False
+        self._invalidate_username_cache(row[0])
         return True
 
+    def activate_user(self, db: Session, user_id: int) -> bool:
+        """Activate a user account"""
+        return self._set_user_flags(db, user_id, is_active=True)
+
     def deactivate_user(self, db: Session, user_id: int) -> bool:
         """Deactivate a user account"""
-        user = db.query(User).filter(User.id == user_id).first()
-        if not user:
-            return False
-
-        user.is_active = False
-        user.updated_at = datetime.utcnow()
-        db.commit()
-        return True
+        return self._set_user_flags(db, user_id, is_active=False)
 
     def promote_to_admin(self, db: Session, user_id: int) -> bool:
         """Promote user to admin"""
-        user = db.query(User).filter(User.id == user_id).first()
-        if not user:
-            return False
-
-        user.is_admin = True
-        user.updated_at = datetime.utcnow()
-        db.commit()
-        return True
+        return self._set_user_flags(db, user_id, is_admin=True)
 
     def demote_from_admin(self, db: Session, user_id: int) -> bool:
         """Remove admin privileges from user"""
-        user = db.query(User).filter(User.id == user_id).first()
-        if not user:
-            return False
-
-        user.is_admin = False
-        user.updated_at = datetime.utcnow()
-        db.commit()
-        return True
+        return self._set_user_flags(db, user_id, is_admin=False)
 
     def get_user_stats(self, db: Session, user_id: int) -> UserStats:
         """Get statistics for a specific user"""
-        # Get user's medicines
-        medicines_count = db.query(func.count(Medicine.id)).filter(
-            Medicine.created_by == user_id
-        ).scalar()
-
-        # Get user's search history
-        searches_count = db.query(func.count(SearchLog.id)).filter(
-            SearchLog.user_id == user_id
-        ).scalar()
-
-        # Get user's OCR scans
-        ocr_scans_count = db.query(func.count(OCRLog.id)).filter(
-            OCRLog.user_id == user_id
-        ).scalar()
-
-        # Get recent activity (last 30 days)
-        thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-        recent_searches = db.query(func.count(SearchLog.id)).filter(
-            SearchLog.user_id == user_id,
-            SearchLog.created_at >= thirty_days_ago
-        ).scalar()
-
-        recent_ocr_scans = db.query(func.count(OCRLog.id)).filter(
-            OCRLog.user_id == user_id,
-            OCRLog.created_at >= thirty_days_ago
-        ).scalar()
-
-        # Get most searched terms
-        most_searched = db.query(SearchLog.query, func.count(SearchLog.id)).filter(
-            SearchLog.user_id == user_id
-        ).group_by(SearchLog.query).order_by(
-            desc(func.count(SearchLog.id))
-        ).limit(5).all()
-
-        most_searched_terms = [term for term, count in most_searched]
-
-        return UserStats(
+        cached = _user_stats_cache.get(user_id)
+        if cached is not None:
+            return cached
+
+        if db.get_bind().dialect.name == "postgresql":
+            # Server-side function (see _create_user_stats_function): all
+            # five counts come back from one round-trip with a cached plan
+            (medicines_count, searches_count, recent_searches,
+             ocr_scans_count, recent_ocr_scans) = db.execute(
+                text("SELECT * FROM user_stats(:uid)"), {"uid": user_id}
+            ).one()
+        else:
+            thirty_days_ago = datetime.utcnow() - timedelta(days=30)
+
+            # Get user's medicines
+            medicines_count = db.query(func.count(Medicine.id)).filter(
+                Medicine.created_by == user_id
+            ).scalar()
+
+            # Total and 30-day counts come from one scan per log table: the
+            # FILTER clause lets both aggregates share the user_id index walk
+            # instead of issuing two round-trips each
+            searches_count, recent_searches = db.query(
+                func.count(SearchLog.id),
+                func.count(SearchLog.id).filter(SearchLog.created_at >= thirty_days_ago),
+            ).filter(SearchLog.user_id == user_id).one()
+
+            ocr_scans_count, recent_ocr_scans = db.query(
+                func.count(OCRLog.id),
+                func.count(OCRLog.id).filter(OCRLog.created_at >= thirty_days_ago),
+            ).filter(OCRLog.user_id == user_id).one()
+
+        # Most searched terms: on Postgres, read the precomputed
+        # user_top_queries materialized view (an indexed five-row fetch)
+        # and only fall through to the live GROUP BY for users who have
+        # no rows there yet - i.e. none at the last refresh
+        most_searched_terms: List[str] = []
+        if db.get_bind().dialect.name == "postgresql":
+            most_searched_terms = [
+                q for (q,) in db.execute(
+                    text("SELECT query FROM user_top_queries "
+                         "WHERE user_id = :uid ORDER BY rank LIMIT 5"),
+                    {"uid": user_id},
+                ).all()
+            ]
+        if not most_searched_terms:
+            most_searched = db.query(SearchLog.query, func.count(SearchLog.id)).filter(
+                SearchLog.user_id == user_id
+            ).group_by(SearchLog.query).order_by(
+                desc(func.count(SearchLog.id))
+            ).limit(5).all()
+            most_searched_terms = [term for term, count in most_searched]
+
+        stats = UserStats(
             user_id=user_id,
             medicines_created=medicines_count,
             total_searches=searches_count,
@@ -206,96 +459,108 @@ class UserService:
             recent_ocr_scans=recent_ocr_scans,
             most_searched_terms=most_searched_terms
         )
+        _user_stats_cache[user_id] = stats
+        return stats
 
     def get_user_activity(self, db: Session, user_id: int, days: int = 30) -> Dict[str, Any]:
         """Get detailed user activity"""
         start_date = datetime.utcnow() - timedelta(days=days)
-        
-        # Get search activity
-        search_activity = db.query(
-            func.date(SearchLog.created_at),
-            func.count(SearchLog.id)
-        ).filter(
-            SearchLog.user_id == user_id,
-            SearchLog.created_at >= start_date
-        ).group_by(
-            func.date(SearchLog.created_at)
-        ).order_by(
-            func.date(SearchLog.created_at)
-        ).all()
-
-        # Get OCR activity
-        ocr_activity = db.query(
-            func.date(OCRLog.created_at),
-            func.count(OCRLog.id)
-        ).filter(
-            OCRLog.user_id == user_id,
-            OCRLog.created_at >= start_date
-        ).group_by(
-            func.date(OCRLog.created_at)
-        ).order_by(
-            func.date(OCRLog.created_at)
-        ).all()
 
-        # Get medicines created
-        medicines_created = db.query(
-            func.date(Medicine.created_at),
-            func.count(Medicine.id)
-        ).filter(
-            Medicine.created_by == user_id,
-            Medicine.created_at >= start_date
-        ).group_by(
-            func.date(Medicine.created_at)
-        ).order_by(
-            func.date(Medicine.created_at)
-        ).all()
+        # All three date histograms come back from one UNION ALL statement
+        # as (source, day, count) rows - one round-trip instead of three,
+        # and the scans can share buffer cache. func.date stays because it
+        # works on both SQLite and Postgres.
+        def _histogram(source, user_col, ts_col):
+            day = func.date(ts_col).label('day')
+            return select(
+                literal(source).label('source'), day, func.count().label('count')
+            ).where(user_col == user_id, ts_col >= start_date).group_by(day)
+
+        rows = db.execute(union_all(
+            _histogram('search', SearchLog.user_id, SearchLog.created_at),
+            _histogram('ocr', OCRLog.user_id, OCRLog.created_at),
+            _histogram('medicine', Medicine.created_by, Medicine.created_at),
+        )).all()
+
+        counts = {'search': {}, 'ocr': {}, 'medicine': {}}
+        for source, day, count in rows:
+            counts[source][str(day)] = count
+
+        # Dense, zero-filled series: one point per day in the window, so
+        # chart clients stop reconstructing the gaps themselves. func.date
+        # yields 'YYYY-MM-DD' strings on SQLite and date objects on
+        # Postgres; str() above normalizes both to the ISO key.
+        start_day = start_date.date()
+        day_keys = [str(start_day + timedelta(days=offset)) for offset in range(days + 1)]
+        series = {
+            source: [{"date": key, "count": per_day.get(key, 0)} for key in day_keys]
+            for source, per_day in counts.items()
+        }
 
         return {
-            "search_activity": [
-                {"date": str(date), "count": count} for date, count in search_activity
-            ],
-            "ocr_activity": [
-                {"date": str(date), "count": count} for date, count in ocr_activity
-            ],
-            "medicines_created": [
-                {"date": str(date), "count": count} for date, count in medicines_created
-            ]
+            "search_activity": series['search'],
+            "ocr_activity": series['ocr'],
+            "medicines_created": series['medicine']
         }
 
-    def get_user_medicines(self, db: Session, user_id: int, skip: int = 0, limit: int = 50) -> List[Medicine]:
-        """Get medicines created by a specific user"""
-        return db.query(Medicine).filter(
-            Medicine.created_by == user_id
-        ).offset(skip).limit(limit).all()
-
-    def get_user_search_history(self, db: Session, user_id: int, skip: int = 0, limit: int = 50) -> List[SearchLog]:
-        """Get search history for a specific user"""
-        return db.query(SearchLog).filter(
-            SearchLog.user_id == user_id
-        ).order_by(desc(SearchLog.created_at)).offset(skip).limit(limit).all()
-
-    def get_user_ocr_history(self, db: Session, user_id: int, skip: int = 0, limit: int = 50) -> List[OCRLog]:
-        """Get OCR scan history for a specific user"""
-        return db.query(OCRLog).filter(
-            OCRLog.user_id == user_id
-        ).order_by(desc(OCRLog.created_at)).offset(skip).limit(limit).all()
+    def get_user_medicines(self, db: Session, user_id: int, skip: int = 0, limit: int = 50,
+                           after_id: Optional[int] = None) -> List[Medicine]:
+        """Get medicines created by a specific user.
+
+        Keyset pagination when after_id is given (last id of the previous
+        page): WHERE id > :after walks the index at constant cost per
+        page, where OFFSET scans and discards skip rows first.
+        """
+        query = db.query(Medicine).filter(Medicine.created_by == user_id)
+        if after_id is not None:
+            return query.filter(Medicine.id > after_id).order_by(Medicine.id).limit(limit).all()
+        return query.offset(skip).limit(limit).all()
+
+    def get_user_search_history(self, db: Session, user_id: int, skip: int = 0, limit: int = 50,
+                                before: Optional[tuple] = None) -> List[SearchLog]:
+        """Get search history for a specific user.
+
+        before is a (created_at, id) cursor taken from the last row of the
+        previous page; the keyset form pages down the (user_id, created_at)
+        index without the scan-and-discard cost of deep OFFSETs.
+        """
+        query = db.query(SearchLog).filter(SearchLog.user_id == user_id)
+        if before is not None:
+            return query.filter(
+                tuple_(SearchLog.created_at, SearchLog.id) < before
+            ).order_by(desc(SearchLog.created_at), desc(SearchLog.id)).limit(limit).all()
+        return query.order_by(desc(SearchLog.created_at)).offset(skip).limit(limit).all()
+
+    def get_user_ocr_history(self, db: Session, user_id: int, skip: int = 0, limit: int = 50,
+                             before: Optional[tuple] = None) -> List[OCRLog]:
+        """Get OCR scan history for a specific user (see
+        get_user_search_history for the cursor contract)"""
+        query = db.query(OCRLog).filter(OCRLog.user_id == user_id)
+        if before is not None:
+            return query.filter(
+                tuple_(OCRLog.created_at, OCRLog.id) < before
+            ).order_by(desc(OCRLog.created_at), desc(OCRLog.id)).limit(limit).all()
+        return query.order_by(desc(OCRLog.created_at)).offset(skip).limit(limit).all()
 
     def delete_user_data(self, db: Session, user_id: int) -> bool:
         """Delete all data associated with a user (GDPR compliance)"""
         try:
-            # Delete user's medicines
-            db.query(Medicine).filter(Medicine.created_by == user_id).delete()
-            
-            # Delete user's search logs
-            db.query(SearchLog).filter(SearchLog.user_id == user_id).delete()
-            
-            # Delete user's OCR logs
-            db.query(OCRLog).filter(OCRLog.user_id == user_id).delete()
-            
-            # Delete the user
-            db.query(User).filter(User.id == user_id).delete()
-            
+            db_user = self.get_user(db, user_id)
+
+            # Schemas created from the current models cascade these from
+            # the user delete, but databases created before the
+            # ondelete="CASCADE" FKs (and SQLite files without foreign
+            # keys enforced) still need the explicit bulk deletes.
+            # synchronize_session=False skips the in-session row sweep
+            # since nothing from these tables is loaded here.
+            db.query(Medicine).filter(Medicine.created_by == user_id).delete(synchronize_session=False)
+            db.query(SearchLog).filter(SearchLog.user_id == user_id).delete(synchronize_session=False)
+            db.query(OCRLog).filter(OCRLog.user_id == user_id).delete(synchronize_session=False)
+            db.query(User).filter(User.id == user_id).delete(synchronize_session=False)
+
             db.commit()
+            if db_user:
+                self._invalidate_username_cache(db_user.username)
             return True
             
         except Exception as e:
@@ -304,28 +569,50 @@ class UserService:
             return False
 
     def get_admin_users(self, db: Session) -> List[User]:
-        """Get all admin users"""
-        return db.query(User).filter(User.is_admin == True).all()
+        """Get all admin users (public columns only)"""
+        return db.query(User).options(
+            load_only(*USER_PUBLIC_COLS)
+        ).filter(User.is_admin == True).all()
 
     def get_active_users(self, db: Session) -> List[User]:
-        """Get all active users"""
-        return db.query(User).filter(User.is_active == True).all()
+        """Get all active users (public columns only)"""
+        return db.query(User).options(
+            load_only(*USER_PUBLIC_COLS)
+        ).filter(User.is_active == True).all()
 
     def get_users_by_activity(self, db: Session, days: int = 30, limit: int = 10) -> List[Dict[str, Any]]:
         """Get most active users"""
         start_date = datetime.utcnow() - timedelta(days=days)
-        
-        # Get users with their activity counts
-        active_users = db.query(
-            User,
-            func.count(SearchLog.id).label('search_count'),
+
+        # Aggregate each log table on its own before joining to users.
+        # Joining both log tables directly produced a cartesian product
+        # per user (every search row paired with every OCR row), which
+        # both inflated the counts and scanned O(searches * scans) rows.
+        searches = db.query(
+            SearchLog.user_id.label('user_id'),
+            func.count(SearchLog.id).label('search_count')
+        ).filter(
+            SearchLog.created_at >= start_date
+        ).group_by(SearchLog.user_id).subquery()
+
+        scans = db.query(
+            OCRLog.user_id.label('user_id'),
             func.count(OCRLog.id).label('ocr_count')
-        ).outerjoin(SearchLog, User.id == SearchLog.user_id).outerjoin(
-            OCRLog, User.id == OCRLog.user_id
         ).filter(
-            (SearchLog.created_at >= start_date) | (OCRLog.created_at >= start_date)
-        ).group_by(User.id).order_by(
-            desc(func.count(SearchLog.id) + func.count(OCRLog.id))
+            OCRLog.created_at >= start_date
+        ).group_by(OCRLog.user_id).subquery()
+
+        search_count = func.coalesce(searches.c.search_count, 0)
+        ocr_count = func.coalesce(scans.c.ocr_count, 0)
+
+        active_users = db.query(
+            User, search_count, ocr_count
+        ).outerjoin(searches, User.id == searches.c.user_id).outerjoin(
+            scans, User.id == scans.c.user_id
+        ).filter(
+            (searches.c.user_id != None) | (scans.c.user_id != None)  # noqa: E711
+        ).order_by(
+            desc(search_count + ocr_count)
         ).limit(limit).all()
 
         return [
@@ -339,20 +626,26 @@ class UserService:
         ]
 
     def generate_api_key(self, db: Session, user_id: int) -> Optional[str]:
-        """Generate a new API key for a user"""
-        user = db.query(User).filter(User.id == user_id).first()
-        if not user:
+        """Generate a new API key for a user.
+
+        Only the keyed digest is persisted; the raw key is returned once
+        to the caller and cannot be recovered from the table.
+        """
+        exists = db.query(User.id).filter(User.id == user_id).first()
+        if not exists:
             return None
 
-        # Generate a secure API key
         api_key = secrets.token_urlsafe(32)
-        
-        # In a real implementation, you might want to store this in a separate table
-        # For now, we'll just return it
+        db.add(ApiKey(user_id=user_id, key_digest=_api_key_digest(api_key)))
+        db.commit()
         return api_key
 
-    def validate_api_key(self, api_key: str) -> Optional[int]:
-        """Validate an API key and return user ID"""
-        # In a real implementation, you would validate against stored API keys
-        # For now, this is a placeholder
-        return None
+    def validate_api_key(self, db: Session, api_key: str) -> Optional[int]:
+        """Validate an API key and return the owning user ID.
+
+        One keyed-hash computation plus one unique-index probe per call.
+        """
+        row = db.query(ApiKey.user_id).filter(
+            ApiKey.key_digest == _api_key_digest(api_key)
+        ).first()
+        return row[0] if row else None